@@ -1,18 +1,28 @@
 import os
+import io
+import pickle
+import hashlib
 import zipfile
 from Bio import SeqIO
-import requests
+
+from pattern_matcher import AhoCorasick, KeywordMatcher
+from uniprot import UniProtFetcher, accession_from_record_id, match_features, DEFAULT_CACHE_DIR as UNIPROT_CACHE_DIR
 
 # Paths
 zip_file_path = "/home/bg171/Project/dbds/DBD_Alignments_v_1.01.zip"
-extracted_dir = "/home/bg171/Project/dbds/DBD_Alignments"
 alignment_subdir = "2018_AddAlignments"
-alignment_dir = os.path.join(extracted_dir, alignment_subdir)
+# Parsed DBD library (family sequences and the compiled matcher), rebuilt when the ZIP changes
+dbd_library_cache = "/home/bg171/Project/dbds/dbd_library.pkl"
+# UniProt entries of the TFs without an alignment match are cached here (set to None to disable the cache)
+uniprot_cache_dir = UNIPROT_CACHE_DIR
+# Pre-downloaded UniProt dump (JSON, JSON lines, XML or a directory of <accession>.json) for nodes without
+# internet; when set, UniProt is never contacted
+uniprot_offline_dump = None
+uniprot_fetcher = UniProtFetcher(cache_dir=uniprot_cache_dir, offline_dump=uniprot_offline_dump)
 fasta_dir = "/home/bg171/Project/FastaFiles"
 output_dir = "/home/bg171/Project/dbds/dbd_locations"
 
 # Create necessary directories
-os.makedirs(extracted_dir, exist_ok=True)
 os.makedirs(output_dir, exist_ok=True)
 
 # Comprehensive keywords associated with TF DNA-binding domains (all in lowercase)
@@ -21,81 +31,100 @@ tf_dbd_keywords = [
     "winged helix", "forkhead", "ets", "tea", "gata-type", "nr c4-type",
     "hox", "myb", "rel", "pou", "mhox", "dm", "bhlh", "zf-c2h2", "zf-c4",
     "zf-c3h1", "t-box", "sry", "ctf/nf-i", "nfat", "dna-binding", "dna binding",
-    "dna-binding", "dna binding", "nucleic acid binding", "sequence-specific dna binding"
+    "nucleic acid binding", "sequence-specific dna binding"
 ]
-
-# Step 1: Extract the specific subdirectory from the ZIP file
-print(f"Extracting files from {zip_file_path}...")
-with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
-    zip_ref.extractall(extracted_dir)
-print(f"Extraction complete. Extracted files are located in {extracted_dir}")
-
-# Function to parse alignment files and extract sequences without gaps, including consensus sequence
-def parse_alignment_files(alignment_dir):
+# All keywords compiled into one matcher that also reports which keyword matched
+dbd_keyword_matcher = KeywordMatcher(tf_dbd_keywords)
+
+# Bump when the cached library layout changes so old caches are rebuilt
+DBD_LIBRARY_VERSION = 1
+
+# Function to read the ungapped sequences (including the consensus sequence) of one FASTA alignment
+def parse_alignment(lines):
+    sequences = []
+    current_sequence = []
+    for line in lines:
+        if line.startswith(">"):
+            if current_sequence:
+                sequences.append("".join(current_sequence).replace("-", ""))
+            current_sequence = []
+        else:
+            current_sequence.append(line.strip())
+    if current_sequence:
+        sequences.append("".join(current_sequence).replace("-", ""))
+    # Keep each sequence once per family, in file order
+    return list(dict.fromkeys(sequence for sequence in sequences if sequence))
+
+# Function to parse the alignment files of one ZIP subdirectory by streaming the members, without extracting them
+def parse_alignment_files(zip_file_path, alignment_subdir):
     dbd_sequences = {}
-    for root, dirs, files in os.walk(alignment_dir):
-        for filename in files:
-            if filename.endswith(".fa"):
-                filepath = os.path.join(root, filename)
-                family = os.path.splitext(filename)[0]
-                print(f"Processing alignment file: {filepath}")
-                with open(filepath, 'r') as file:
-                    sequences = []
-                    current_sequence = ""
-                    for line in file:
-                        if line.startswith(">"):
-                            if current_sequence:
-                                sequences.append(current_sequence.replace("-", ""))
-                            current_sequence = ""
-                        else:
-                            current_sequence += line.strip()
-                    if current_sequence:
-                        sequences.append(current_sequence.replace("-", ""))
-                    if sequences:
-                        dbd_sequences[family] = sequences
+    with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
+        for member in zip_ref.infolist():
+            parts = member.filename.split("/")
+            if member.is_dir() or alignment_subdir not in parts[:-1] or not member.filename.endswith(".fa"):
+                continue
+            family = os.path.splitext(parts[-1])[0]
+            with zip_ref.open(member) as file:
+                sequences = parse_alignment(io.TextIOWrapper(file, encoding="utf-8", errors="replace"))
+            if sequences:
+                dbd_sequences[family] = sequences
+    print(f"Parsed {len(dbd_sequences)} alignment families from {zip_file_path}")
     return dbd_sequences
 
-# Function to identify DBD locations in a given sequence
-def find_dbd_locations(sequence, dbd_sequences):
-    locations = []
+def file_checksum(file_path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Function to load the DBD library from the cache, or parse the ZIP and cache it if the ZIP has changed
+def load_dbd_library(zip_file_path, alignment_subdir, cache_path):
+    checksum = file_checksum(zip_file_path)
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                library = pickle.load(f)
+            if (library.get("version") == DBD_LIBRARY_VERSION and library.get("checksum") == checksum
+                    and library.get("alignment_subdir") == alignment_subdir):
+                print(f"Loaded DBD library from {cache_path}")
+                return library["dbd_sequences"], library["dbd_matcher"], library["families_by_sequence"]
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError) as e:
+            print(f"Ignoring unreadable DBD library cache {cache_path}: {e}")
+
+    dbd_sequences = parse_alignment_files(zip_file_path, alignment_subdir)
+    dbd_matcher, families_by_sequence = build_dbd_matcher(dbd_sequences)
+    if cache_path:
+        library = {"version": DBD_LIBRARY_VERSION, "checksum": checksum, "alignment_subdir": alignment_subdir,
+                   "dbd_sequences": dbd_sequences, "dbd_matcher": dbd_matcher, "families_by_sequence": families_by_sequence}
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(library, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+        print(f"Saved DBD library to {cache_path}")
+    return dbd_sequences, dbd_matcher, families_by_sequence
+
+# Function to build one automaton over the DBD sequences of every family, and the families of each sequence
+def build_dbd_matcher(dbd_sequences):
+    families_by_sequence = {}
     for family, sequences in dbd_sequences.items():
         for dbd_seq in sequences:
-            start = sequence.find(dbd_seq)
-            if start != -1:
-                end = start + len(dbd_seq)
-                locations.append((start + 1, end))  # Convert to 1-based index
+            families_by_sequence.setdefault(dbd_seq, []).append(family)
+    dbd_matcher = AhoCorasick(families_by_sequence)
+    print(f"Built DBD matcher over {len(dbd_matcher)} unique sequences from {len(dbd_sequences)} families")
+    return dbd_matcher, families_by_sequence
+
+# Function to identify all DBD locations in a given sequence in one scan; returns (start, end, family) tuples
+def find_dbd_locations(sequence, dbd_matcher, families_by_sequence):
+    locations = []
+    for start, end, pattern_index in dbd_matcher.iter_matches(sequence):
+        for family in families_by_sequence[dbd_matcher.patterns[pattern_index]]:
+            locations.append((start + 1, end, family))  # Convert to 1-based index
     return locations
 
-# Function to fetch and parse UniProt entry
-def fetch_uniprot_entry(sequence_id):
-    url = f"https://rest.uniprot.org/uniprotkb/{sequence_id}.json"
-    headers = {
-        "User-Agent": "Mozilla/5.0",
-    }
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        return response.json()
-    else:
-	print(f"Failed to fetch UniProt entry for {sequence_id}: {response.status_code}")
-        return None
-
-# Function to extract relevant features based on keywords from UniProt entry
-def extract_relevant_features(uniprot_entry, keywords):
-    features = []
-    if uniprot_entry:
-        for feature in uniprot_entry.get('features', []):
-            feature_type = feature.get('type', '').lower()
-            description = feature.get('description', '').lower()
-            note = feature.get('note', '').lower()
-            start = feature.get('location', {}).get('start', {}).get('value')
-            end = feature.get('location', {}).get('end', {}).get('value')
-
-            # Check if any keyword matches the type, description, or note
-            if any(keyword in feature_type for keyword in keywords) or \
-               any(keyword in description for keyword in keywords) or \
-               any(keyword in note for keyword in keywords):
-                features.append((start, end))
-    return features
+# Function to extract relevant features based on keywords from UniProt entry; returns (start, end, keyword) tuples
+def extract_relevant_features(uniprot_entry, keyword_matcher):
+    return match_features(uniprot_entry, keyword_matcher)
 
 # Function to merge overlapping and adjacent ranges
 def merge_ranges(ranges):
@@ -112,67 +141,80 @@ def merge_ranges(ranges):
             merged_ranges.append(current)
     return merged_ranges
 
-# Step 2: Parse alignment files to get DBD sequences
-dbd_sequences = parse_alignment_files(alignment_dir)
-
-# Step 3: Process each FASTA file and identify DBD locations
+# Step 1: Load the DBD sequences of the alignment files and the matcher compiled from them
+dbd_sequences, dbd_matcher, families_by_sequence = load_dbd_library(zip_file_path, alignment_subdir, dbd_library_cache)
+
+# Step 2: Scan every FASTA sequence for DBDs
+fasta_records = {}
+for fasta_file in sorted(os.listdir(fasta_dir)):
+    if fasta_file.endswith(".fa"):
+        fasta_path = os.path.join(fasta_dir, fasta_file)
+        fasta_records[fasta_file] = []
+        for record in SeqIO.parse(fasta_path, "fasta"):
+            sequence = str(record.seq)
+            print(f"Processing sequence {record.id} with length {len(sequence)}")
+            fasta_records[fasta_file].append((record.id, len(sequence), find_dbd_locations(sequence, dbd_matcher, families_by_sequence)))
+
+# Step 3: Look up the sequences without an alignment match in UniProt, all in one batched request
+unmatched_accessions = [accession_from_record_id(record_id) for records in fasta_records.values()
+                        for record_id, _, dbd_locations in records if not dbd_locations]
+uniprot_entries = uniprot_fetcher.fetch_many(unmatched_accessions) if unmatched_accessions else {}
+
+# Step 4: Write the DBD locations of each FASTA file
 missing_dbd_log = os.path.join(output_dir, "missing_dbd_log.txt")
 valid_dbd_log = os.path.join(output_dir, "valid_dbd_log.txt")
 with open(missing_dbd_log, 'w') as missing_log, open(valid_dbd_log, 'w') as valid_log:
-    for fasta_file in os.listdir(fasta_dir):
-        if fasta_file.endswith(".fa"):
-            fasta_path = os.path.join(fasta_dir, fasta_file)
-            output_file = os.path.join(output_dir, f"{fasta_file}.dbd_locations.txt")
-
-            with open(output_file, 'w') as out_f:
-                for record in SeqIO.parse(fasta_path, "fasta"):
-                    sequence = str(record.seq)
-                    sequence_length = len(sequence)
-                    print(f"Processing sequence {record.id} with length {sequence_length}")
-                    dbd_locations = find_dbd_locations(sequence, dbd_sequences)
-
-                    out_f.write(f">{record.id}\n")
-                    if dbd_locations:
-                        # Filter out full sequence range if it appears
-                        filtered_locations = [
-                            (start, end) for start, end in dbd_locations if not (start == 1 and end == sequence_length)
-                        ]
-                        if filtered_locations:
-                            merged_locations = merge_ranges(filtered_locations)
-                            if merged_locations:
-                                start, end = merged_locations[0]
-                                locations_str = f"{start}-{end}"
-                                out_f.write(f"Location: {locations_str}\n")
-                                valid_log.write(f"{fasta_file}\n")
-                            else:
-                                out_f.write("No valid DBD locations found.\n")
-                                missing_log.write(f"{fasta_file}\n")
+    for fasta_file, records in fasta_records.items():
+        output_file = os.path.join(output_dir, f"{fasta_file}.dbd_locations.txt")
+
+        with open(output_file, 'w') as out_f:
+            for record_id, sequence_length, dbd_locations in records:
+                out_f.write(f">{record_id}\n")
+                if dbd_locations:
+                    # Filter out full sequence range if it appears
+                    filtered_locations = [
+                        (start, end) for start, end, _ in dbd_locations if not (start == 1 and end == sequence_length)
+                    ]
+                    # Record every occurrence and its family, before merging, for auditing
+                    out_f.write("Matches: " + ", ".join(f"{family}:{start}-{end}" for start, end, family in dbd_locations) + "\n")
+                    if filtered_locations:
+                        merged_locations = merge_ranges(filtered_locations)
+                        if merged_locations:
+                            start, end = merged_locations[0]
+                            locations_str = f"{start}-{end}"
+                            out_f.write(f"Location: {locations_str}\n")
+                            valid_log.write(f"{fasta_file}\n")
                         else:
                             out_f.write("No valid DBD locations found.\n")
                             missing_log.write(f"{fasta_file}\n")
                     else:
-                        # If no locations found, search UniProt API
-                        uniprot_entry = fetch_uniprot_entry(record.id)
-                        features = extract_relevant_features(uniprot_entry, tf_dbd_keywords)
-                        if features:
-                            filtered_features = [
-                                (start, end) for start, end in features if not (start == 1 and end == sequence_length)
-                            ]
-                            if filtered_features:
-                                merged_features = merge_ranges(filtered_features)
-                                if merged_features:
-                                    start, end = merged_features[0]
-                                    locations_str = f"{start}-{end}"
-                                    out_f.write(f"Location: {locations_str}\n")
-                                    valid_log.write(f"{fasta_file}\n")
-                                else:
-                                    out_f.write("No valid features found in UniProt search results.\n")
-                                    missing_log.write(f"{fasta_file}\n")
+                        out_f.write("No valid DBD locations found.\n")
+                        missing_log.write(f"{fasta_file}\n")
+                else:
+                    # If no locations found, use the UniProt entry
+                    uniprot_entry = uniprot_entries.get(accession_from_record_id(record_id))
+                    features = extract_relevant_features(uniprot_entry, dbd_keyword_matcher)
+                    if features:
+                        filtered_features = [
+                            (start, end) for start, end, _ in features if not (start == 1 and end == sequence_length)
+                        ]
+                        # Record the keyword behind every UniProt feature, for auditing
+                        out_f.write("UniProt matches: " + ", ".join(f"{keyword}:{start}-{end}" for start, end, keyword in features) + "\n")
+                        if filtered_features:
+                            merged_features = merge_ranges(filtered_features)
+                            if merged_features:
+                                start, end = merged_features[0]
+                                locations_str = f"{start}-{end}"
+                                out_f.write(f"Location: {locations_str}\n")
+                                valid_log.write(f"{fasta_file}\n")
                             else:
                                 out_f.write("No valid features found in UniProt search results.\n")
                                 missing_log.write(f"{fasta_file}\n")
                         else:
-                            out_f.write("No relevant features found in UniProt search results.\n")
+                            out_f.write("No valid features found in UniProt search results.\n")
                             missing_log.write(f"{fasta_file}\n")
+                    else:
+                        out_f.write("No relevant features found in UniProt search results.\n")
+                        missing_log.write(f"{fasta_file}\n")
 
 print("DBD location identification complete. Check missing_dbd_log.txt for missing DBDs and valid_dbd_log.txt for valid DBDs.")
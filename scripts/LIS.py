@@ -4,15 +4,14 @@
 import os
 import sys
 import subprocess
-import pickle
 import numpy as np
 import pandas as pd
-from Bio import PDB
-import io
-import time
 import traceback
 import logging
-import csv
+import re
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 # Function to run a command and capture its output
 def run_command(command):
@@ -30,119 +29,100 @@ def activate_conda_env(env_name):
     return python_path
 
 # Activate the AlphaFold environment and get the Python path
-python_path = activate_conda_env("alphafold_v2.3.1")
+# (only in the parent process; pool workers re-import this module under spawn)
+if __name__ == "__main__":
+    python_path = activate_conda_env("alphafold_v2.3.1")
 
-# Run the rest of the script using the activated environment's Python
-if sys.executable != python_path:
-    os.execl(python_path, python_path, *sys.argv)
+    # Run the rest of the script using the activated environment's Python
+    if sys.executable != python_path:
+        os.execl(python_path, python_path, *sys.argv)
 
 import af2plots
 print("af2plots module imported successfully!")
 print(sys.executable)
 
-class DummyJaxArray:
-    def __init__(self, *args, **kwargs):
-        self.shape = args[0] if args else None
-        self.dtype = kwargs.get('dtype', None)
-
-    def __getattr__(self, name):
-        return lambda *args, **kwargs: self
-
-    def __array__(self):
-        import numpy as np
-        if self.shape:
-            return np.zeros(self.shape)
-        return np.array([])
-
-class CustomUnpickler(pickle.Unpickler):
-    def find_class(self, module, name):
-        if module == "jax._src.device_array":
-            return DummyJaxArray
-        return super().find_class(module, name)
-
-def custom_load_pickle(file):
-    if isinstance(file, (str, bytes, os.PathLike)):
-        with open(file, 'rb') as f:
-            return CustomUnpickler(f).load()
-    elif isinstance(file, io.IOBase):
-        return CustomUnpickler(file).load()
-    else:
-        raise TypeError(f"Unsupported file type: {type(file)}")
+from af2_utils import custom_load_pickle, load_result_metrics, read_chain_lengths, DEFAULT_CACHE_DIR
+from pae_store import open_pae_store
+from lis_kernel import lis_lia
 
 # Monkey-patch the pickle.load function in af2plots
 import af2plots.plotter
 af2plots.plotter.pickle.load = custom_load_pickle
 
 # Now proceed with the rest of the script
-def reverse_and_scale_matrix(matrix: np.ndarray, pae_cutoff: float = 12.0) -> np.ndarray:
-    scaled_matrix = (pae_cutoff - matrix) / pae_cutoff
-    scaled_matrix = np.clip(scaled_matrix, 0, 1)
-    return scaled_matrix
-
-def process_alphafold_output(base_directory: str, model_numbers: int = 5, recycling_numbers: int = 5, Protein_1 = "A", Protein_2 = "B", pae_cutoff: float = 12.0) -> pd.DataFrame:
+MODEL_RESULT_PATTERN = re.compile(r"^result_model_(\d+)_multimer_v3_pred_(\d+)\.pkl$")
+
+# Function to find the model/recycle result pickles that actually exist in a prediction directory
+def discover_model_results(base_directory: str, model_numbers: int = 5, recycling_numbers: int = 5) -> list:
+    model_results = []
+    for filename in os.listdir(base_directory):
+        match = MODEL_RESULT_PATTERN.match(filename)
+        if match:
+            model_num, recycling_num = int(match.group(1)), int(match.group(2))
+            if model_num <= model_numbers and recycling_num < recycling_numbers:
+                model_results.append((model_num, recycling_num, filename))
+    return sorted(model_results)
+
+def process_alphafold_output(base_directory: str, model_numbers: int = 5, recycling_numbers: int = 5, Protein_1 = "A", Protein_2 = "B", pae_cutoff: float = 12.0, cache_dir: str = DEFAULT_CACHE_DIR, pae_store_dir: str = None, cutoff_sweep: tuple = ()) -> pd.DataFrame:
     series_list = []
 
-    for model_num in range(1, model_numbers+1):
-        for recycling_num in range(0, recycling_numbers):
-            pdb_name = f"ranked_0.pdb"
-            pdb_file_path = os.path.join(base_directory, pdb_name)
-
-            parser = PDB.PDBParser(QUIET=True)
-            structure = parser.get_structure("example", pdb_file_path)
-
-            chain_lengths = {}
-
-            for model in structure:
-                for chain in model:
-                    chain_id = chain.get_id()
-                    chain_length = sum(1 for _ in chain.get_residues())
-                    chain_lengths[chain_id] = chain_length
-                    protein_a_len = chain_lengths.get('B', 0)
-
-            pkl_name = f"result_model_1_multimer_v3_pred_0.pkl"
-            pkl_file_path = os.path.join(base_directory, pkl_name)
-            with open(pkl_file_path, 'rb') as f:
-                d = custom_load_pickle(f)
-            iptm = d.get('iptm')
-            ptm = d.get('ptm')
-            pae = d.get('predicted_aligned_error')
-            plddt = np.mean(d.get('plddt'))
-            confidence = d.get('ranking_confidence')
-
-            thresholded_pae = np.where(pae < pae_cutoff, 1, 0)
-
-            local_interaction_protein_a = np.count_nonzero(thresholded_pae[:protein_a_len, :protein_a_len])
-            local_interaction_protein_b = np.count_nonzero(thresholded_pae[protein_a_len:, protein_a_len:])
-            local_interaction_interface_1 = np.count_nonzero(thresholded_pae[:protein_a_len, protein_a_len:])
-            local_interaction_interface_2 = np.count_nonzero(thresholded_pae[protein_a_len:, :protein_a_len])
-            local_interaction_interface_avg = (local_interaction_interface_1 + local_interaction_interface_2)
-
-            scaled_pae = reverse_and_scale_matrix(pae, pae_cutoff)
-            selected_values_interaction1_score = scaled_pae[:protein_a_len, protein_a_len:][thresholded_pae[:protein_a_len, protein_a_len:] == 1]
-            average_selected_interaction1_score = np.mean(selected_values_interaction1_score) if selected_values_interaction1_score.size > 0 else 0
-            selected_values_interaction2_score = scaled_pae[protein_a_len:, :protein_a_len][thresholded_pae[protein_a_len:, :protein_a_len] == 1]
-            average_selected_interaction2_score = np.mean(selected_values_interaction2_score) if selected_values_interaction2_score.size > 0 else 0
-            average_selected_interaction_total_score = (average_selected_interaction1_score + average_selected_interaction2_score) / 2
-
-            series_list.append(pd.Series({
-                'Protein_1': Protein_1,
-                'Protein_2': Protein_2,
-                'LIS': round(average_selected_interaction_total_score, 3),
-                'LIA': local_interaction_interface_avg,
-                'ipTM': round(float(iptm), 3),
-                'Confidence': round(float(iptm*0.8 + ptm*0.2), 3),
-                'pTM': round(float(ptm), 3),
-                'pLDDT': round(plddt, 2),
-                'Model': model_num,
-                'Recycle': recycling_num,
-                'saved folder': os.path.dirname(pdb_file_path),
-                'pdb': os.path.basename(pdb_file_path),
-                'pkl': os.path.basename(pkl_file_path),
-            }))
+    # The chain lengths are shared by every model of the complex, so the PDB is parsed once
+    pdb_name = "ranked_0.pdb"
+    pdb_file_path = os.path.join(base_directory, pdb_name)
+    chain_lengths = read_chain_lengths(pdb_file_path)
+    protein_a_len = chain_lengths.get('B', 0)
+
+    # PAE matrices come from the memory-mapped store when one is given and holds this model
+    job = os.path.basename(os.path.normpath(base_directory))
+    store = open_pae_store(pae_store_dir) if pae_store_dir else None
+
+    # Load each result pickle that was actually produced exactly once and score it straight away,
+    # so only one PAE matrix (or store view) is held at a time
+    cutoffs = [pae_cutoff] + list(cutoff_sweep)
+    model_results = []
+    for model_num, recycling_num, pkl_name in discover_model_results(base_directory, model_numbers, recycling_numbers):
+        pkl_file_path = os.path.join(base_directory, pkl_name)
+        model_name = os.path.splitext(pkl_name)[0]
+        if store is not None and store.is_current(job, model_name, pkl_file_path):
+            # The store keeps ipTM, pTM and mean pLDDT next to the matrix, so the pickle is not read at all
+            d = store.metrics(job, model_name)
+            pae = store.get(job, model_name)
+        else:
+            d = load_result_metrics(pkl_file_path, ('iptm', 'ptm', 'predicted_aligned_error', 'plddt'), cache_dir=cache_dir)
+            d['mean_plddt'] = np.mean(d['plddt'])
+            pae = d['predicted_aligned_error']
+        # All cutoffs (the main one and any calibration sweep) are scored from the interface blocks only
+        scores = lis_lia(pae, protein_a_len, cutoffs)
+        model_results.append((model_num, recycling_num, pkl_name, d['iptm'], d['ptm'], d['mean_plddt'], scores))
+
+    for model_num, recycling_num, pkl_name, iptm, ptm, plddt, scores in model_results:
+        row = {
+            'Protein_1': Protein_1,
+            'Protein_2': Protein_2,
+            'LIS': round(scores['LIS'][0], 3),
+            'LIA': scores['LIA'][0],
+            'ipTM': round(float(iptm), 3),
+            'Confidence': round(float(iptm*0.8 + ptm*0.2), 3),
+            'pTM': round(float(ptm), 3),
+            'pLDDT': round(plddt, 2),
+            'Model': model_num,
+            'Recycle': recycling_num,
+            'saved folder': base_directory,
+            'pdb': pdb_name,
+            'pkl': pkl_name,
+        }
+        for c, sweep_cutoff in enumerate(cutoff_sweep, start=1):
+            row[f'LIS@{sweep_cutoff:g}'] = round(scores['LIS'][c], 3)
+            row[f'LIA@{sweep_cutoff:g}'] = scores['LIA'][c]
+        series_list.append(pd.Series(row))
+
+    if not series_list:
+        print(f"No result pickles found in {base_directory}")
+        return pd.DataFrame(), False
 
     result_df = pd.concat(series_list, axis=1).T
 
-    # Calculate Best and Average LIS and LIA
+    # Calculate Best and Average LIS and LIA over the distinct models
     best_lis = result_df['LIS'].max()
     best_lia = result_df['LIA'].max()
     avg_lis = result_df['LIS'].mean()
@@ -173,36 +153,33 @@ pae_cutoff = 30
 lis_threshold = 0.103
 lia_threshold = 3432.0
 
-# List all directories starting with 'Q09472_1018-1840_and_'
-subdirectories = [d for d in os.listdir(base_directory) if os.path.isdir(os.path.join(base_directory, d)) and d.startswith('Q09472_320-440_566-661_1018-1840_1660-1840_1900-2100_and_')]
-
-positive_predictions_list = []
-total_predictions_list = []
-
-for subdirectory in subdirectories:
+# Function to score one prediction directory, capturing any error so a bad directory doesn't stop the pool
+def score_subdirectory(subdirectory, base_directory, model_numbers, recycling_numbers, Protein_1, Protein_2, pae_cutoff, cache_dir, pae_store_dir, cutoff_sweep):
     subdirectory_path = os.path.join(base_directory, subdirectory)
     try:
         total_prediction, is_positive = process_alphafold_output(
             subdirectory_path, model_numbers, recycling_numbers,
-            Protein_1, Protein_2, pae_cutoff
+            Protein_1, Protein_2, pae_cutoff, cache_dir, pae_store_dir, cutoff_sweep
         )
-        if not total_prediction.empty:
-            total_predictions_list.append(total_prediction)
-            if is_positive:
-                positive_predictions_list.append(total_prediction)
+        return subdirectory, total_prediction, is_positive, None
     except Exception as e:
-        print(f"Error processing directory {subdirectory}: {str(e)}")
-
-# Combine all the results into single DataFrames
-if total_predictions_list:
-    total_predictions_df = pd.concat(total_predictions_list, ignore_index=True)
-else:
-    total_predictions_df = pd.DataFrame()
-
-if positive_predictions_list:
-    positive_predictions_df = pd.concat(positive_predictions_list, ignore_index=True)
-else:
-    positive_predictions_df = pd.DataFrame()
+        return subdirectory, None, False, str(e)
+
+# Function to score all directories, serially or fanned out over a process pool (results keep directory order)
+def score_subdirectories(subdirectories, workers=1, chunksize=None, cache_dir=DEFAULT_CACHE_DIR, pae_store_dir=None, cutoff_sweep=()):
+    score = partial(score_subdirectory, base_directory=base_directory, model_numbers=model_numbers,
+                    recycling_numbers=recycling_numbers, Protein_1=Protein_1, Protein_2=Protein_2,
+                    pae_cutoff=pae_cutoff, cache_dir=cache_dir,
+                    pae_store_dir=pae_store_dir, cutoff_sweep=tuple(cutoff_sweep))
+    if workers <= 1:
+        yield from map(score, subdirectories)
+        return
+
+    if chunksize is None:
+        # Roughly four chunks per worker balances scheduling overhead against stragglers
+        chunksize = max(1, len(subdirectories) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(score, subdirectories, chunksize=chunksize)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -210,30 +187,71 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 def log_message(message):
     logging.info(message)
 
-# Write DataFrames to an Excel file with three sheets
-log_message("Writing results to csv file...")
+def main():
+    parser = argparse.ArgumentParser(description="Calculate LIS/LIA scores for AlphaFold-Multimer predictions")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes used to score directories")
+    parser.add_argument("--chunksize", type=int, default=None, help="directories handed to a worker at a time (default: automatic)")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="directory of the per-pickle metric cache")
+    parser.add_argument("--no-cache", action="store_true", help="always unpickle the result files and skip the metric cache")
+    parser.add_argument("--pae-store", default=None, help="memory-mapped PAE store built with pae_store.py")
+    parser.add_argument("--cutoff-sweep", type=float, nargs='+', default=[], help="extra PAE cutoffs whose LIS/LIA are added as 'LIS@<cutoff>'/'LIA@<cutoff>' columns for threshold calibration")
+    args = parser.parse_args()
+    cache_dir = None if args.no_cache else args.cache_dir
+
+    # List all directories starting with 'Q09472_1018-1840_and_'
+    subdirectories = [d for d in os.listdir(base_directory) if os.path.isdir(os.path.join(base_directory, d)) and d.startswith('Q09472_320-440_566-661_1018-1840_1660-1840_1900-2100_and_')]
+    log_message(f"Scoring {len(subdirectories)} directories with {args.workers} worker(s)...")
+
+    positive_predictions_list = []
+    total_predictions_list = []
+
+    for subdirectory, total_prediction, is_positive, error in score_subdirectories(subdirectories, args.workers, args.chunksize, cache_dir, args.pae_store, args.cutoff_sweep):
+        if error is not None:
+            print(f"Error processing directory {subdirectory}: {error}")
+            continue
+        if not total_prediction.empty:
+            total_predictions_list.append(total_prediction)
+            if is_positive:
+                positive_predictions_list.append(total_prediction)
 
-try:
-    if not positive_predictions_df.empty:
-        positive_predictions_df.to_csv('Positive_PPI.csv', index=False)
-        log_message(f"Wrote {len(positive_predictions_df)} rows to 'Positive_PPI.csv'")
+    # Combine all the results into single DataFrames
+    if total_predictions_list:
+        total_predictions_df = pd.concat(total_predictions_list, ignore_index=True)
     else:
-        pd.DataFrame().to_csv('Positive_PPI.csv', index=False)
-        log_message("Wrote empty DataFrame to 'Positive_PPI.csv'")
+        total_predictions_df = pd.DataFrame()
 
-    if not total_predictions_df.empty:
-        total_predictions_df.to_csv('Total_Prediction.csv', index=False)
-        log_message(f"Wrote {len(total_predictions_df)} rows to 'Total_Prediction.csv'")
+    if positive_predictions_list:
+        positive_predictions_df = pd.concat(positive_predictions_list, ignore_index=True)
     else:
-        pd.DataFrame().to_csv('Total_Prediction.csv', index=False)
-        log_message("Wrote empty DataFrame to 'Total_Prediction.csv'")
+        positive_predictions_df = pd.DataFrame()
+
+    # Write DataFrames to an Excel file with three sheets
+    log_message("Writing results to csv file...")
 
-    metrics_data_df.to_csv('Optimal_Thresholds.csv', index=False)
-    log_message(f"Wrote {len(metrics_data_df)} rows to 'Optimal_Thresholds.csv'")
+    try:
+        if not positive_predictions_df.empty:
+            positive_predictions_df.to_csv('Positive_PPI.csv', index=False)
+            log_message(f"Wrote {len(positive_predictions_df)} rows to 'Positive_PPI.csv'")
+        else:
+            pd.DataFrame().to_csv('Positive_PPI.csv', index=False)
+            log_message("Wrote empty DataFrame to 'Positive_PPI.csv'")
+
+        if not total_predictions_df.empty:
+            total_predictions_df.to_csv('Total_Prediction.csv', index=False)
+            log_message(f"Wrote {len(total_predictions_df)} rows to 'Total_Prediction.csv'")
+        else:
+            pd.DataFrame().to_csv('Total_Prediction.csv', index=False)
+            log_message("Wrote empty DataFrame to 'Total_Prediction.csv'")
+
+        metrics_data_df.to_csv('Optimal_Thresholds.csv', index=False)
+        log_message(f"Wrote {len(metrics_data_df)} rows to 'Optimal_Thresholds.csv'")
+
+        log_message("CSV file generation complete.")
+    except Exception as e:
+        log_message(f"Error writing CSV files: {str(e)}")
+        log_message(traceback.format_exc())
 
-    log_message("CSV file generation complete.")
-except Exception as e:
-    log_message(f"Error writing CSV files: {str(e)}")
-    log_message(traceback.format_exc())
+    log_message("Script finished.")
 
-log_message("Script finished.")
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,8 @@ import os
 import sys
 import subprocess
 import json
-import pickle
 import numpy as np
 import pandas as pd
-from Bio import PDB
 from absl import flags, app, logging
 
 # Function to activate conda environment
@@ -36,6 +34,9 @@ if sys.executable != python_path:
     os.execl(python_path, python_path, *sys.argv)
 
 # Now proceed with the rest of the script
+from af2_utils import load_result_metrics, read_chain_lengths, DEFAULT_CACHE_DIR
+from pae_store import open_pae_store, RESULT_PKL_PATTERN
+
 print("Installing the packages")
 print("Setting the flags")
 flags.DEFINE_string("output_dir", '/home/bg171/Project/p300/Predictions', "directory where predicted models are stored")
@@ -46,6 +47,14 @@ flags.DEFINE_float("cutoff", 10.0, "cutoff value of PAE for IDPs. i.e. only pae<
 flags.DEFINE_boolean("create_notebook", True, "Whether creating a notebook")
 flags.DEFINE_integer("surface_thres", 50, "surface threshold for IDPs. must be integer")
 flags.DEFINE_integer("pae_figsize", 50, "figsize of pae_plot, default is 50")
+flags.DEFINE_float("min_iptm_ptm", 0.0, "skip models whose iptm+ptm in ranking_debug.json is below this, without loading their pickles")
+flags.DEFINE_boolean("score_all_models", False, "check every model in ranking order instead of only the best-ranked one")
+flags.DEFINE_integer("jobs_per_page", 25, "number of jobs per notebook page, 0 puts every job in one notebook")
+flags.DEFINE_boolean("prerender_pae", False, "render the PAE plots to PNG once and embed the images in the notebooks")
+flags.DEFINE_string("pae_image_dir", '', "directory of the pre-rendered PAE plots (default: <notebook_output_dir>/pae_plots)")
+flags.DEFINE_boolean("verbose_file_check", False, "print the missing files of every skipped group")
+flags.DEFINE_string("pae_store_dir", '', "memory-mapped PAE store built with pae_store.py, empty to read the pickles")
+flags.DEFINE_string("metric_cache_dir", DEFAULT_CACHE_DIR, "directory of the per-pickle metric cache, empty to disable it")
 FLAGS = flags.FLAGS
 
 def read_file_list(file_list_path):
@@ -65,121 +74,195 @@ def read_file_list(file_list_path):
     
     return file_groups
 
-def check_files_exist(file_groups, base_path):
+def index_group_files(file_groups, base_path):
+    # One directory listing per group instead of one stat per listed file
+    present_files = {}
+    for group in file_groups:
+        try:
+            with os.scandir(os.path.join(base_path, group)) as entries:
+                present_files[group] = {entry.name for entry in entries}
+        except (FileNotFoundError, NotADirectoryError):
+            present_files[group] = None
+    return present_files
+
+def check_files_exist(file_groups, base_path, verbose=False):
+    present_files = index_group_files(file_groups, base_path)
     valid_groups = {}
     skipped_groups = []
+    missing_file_count = 0
     for group, files in file_groups.items():
-        print(f"Checking group: {group}")
-        all_files_exist = True
+        present = present_files[group]
         missing_files = []
         for file in files:
-            file_path = os.path.join(base_path, group, file)
-            if not os.path.exists(file_path):
-                print(f"File not found: {file_path}")
-                all_files_exist = False
-                missing_files.append(file_path)
-            else:
-                print(f"File found: {file_path}")
-
-        if all_files_exist:
+            if present is None:
+                missing_files.append(os.path.join(base_path, group, file))
+            elif not file:
+                continue  # Blank separator lines in file_list.txt only require the directory
+            elif '/' in file:
+                # Nested entries are not covered by the directory listing
+                if not os.path.exists(os.path.join(base_path, group, file)):
+                    missing_files.append(os.path.join(base_path, group, file))
+            elif file not in present:
+                missing_files.append(os.path.join(base_path, group, file))
+
+        if not missing_files:
             valid_groups[group] = files
         else:
-            print(f"Skipping group {group} due to missing files: {missing_files}")
-            skipped_groups.append(group)
-    return valid_groups, skipped_groups
-def check_files_exist(file_groups, base_path):
-    valid_groups = {}
-    skipped_groups = []
-    for group, files in file_groups.items():
-        print(f"Checking group: {group}")
-        all_files_exist = True
-        missing_files = []
-        for file in files:
-            file_path = os.path.join(base_path, group, file)
-            if not os.path.exists(file_path):
-                print(f"File not found: {file_path}")
-                all_files_exist = False
-                missing_files.append(file_path)
-            else:
-                print(f"File found: {file_path}")
-
-        if all_files_exist:
-            valid_groups[group] = files
-        else:
-            print(f"Skipping group {group} due to missing files: {missing_files}")
+            if verbose:
+                print(f"Skipping group {group} due to missing files: {missing_files}")
             skipped_groups.append(group)
+            missing_file_count += len(missing_files)
+
+    print(f"Checked {sum(len(files) for files in file_groups.values())} files in {len(file_groups)} groups: "
+          f"{len(valid_groups)} complete, {len(skipped_groups)} skipped with {missing_file_count} missing files")
     return valid_groups, skipped_groups
 
-def collect_job_data(valid_groups, base_path):
+def collect_job_data(valid_groups, base_path, min_iptm_ptm=0.0, score_all_models=False):
+    # Models to check per job, in ranking order, with their iptm+ptm from ranking_debug.json;
+    # models below min_iptm_ptm are dropped here so their pickles are never loaded
     job_data = []
     missing_ranking_debug = 0
+    below_floor = 0
     for group in valid_groups:
         result_subdir = os.path.join(base_path, group.strip())
         ranking_debug_path = os.path.join(result_subdir, "ranking_debug.json")
         if os.path.isfile(ranking_debug_path):
             with open(ranking_debug_path, 'r') as f:
                 ranking_data = json.load(f)
-            best_model = ranking_data["order"][0]
             if "iptm+ptm" in ranking_data:
-                iptm_ptm_score = ranking_data["iptm+ptm"][best_model]
-                job_data.append((group, iptm_ptm_score))
+                ranked_models = ranking_data["order"] if score_all_models else ranking_data["order"][:1]
+                models = [(model, ranking_data["iptm+ptm"][model]) for model in ranked_models
+                          if ranking_data["iptm+ptm"][model] >= min_iptm_ptm]
+                if models:
+                    job_data.append((group, models))
+                else:
+                    below_floor += 1
         else:
             print(f"ranking_debug.json not found for {group}")
             missing_ranking_debug += 1
     print(f"Number of groups missing ranking_debug.json: {missing_ranking_debug}")
+    print(f"Number of groups below the iptm+ptm floor of {min_iptm_ptm}: {below_floor}")
     return job_data
 
 def obtain_seq_lengths(result_subdir):
-    pdb_files = [f for f in os.listdir(result_subdir) if f.endswith('.pdb')]
-    seq_lengths = []
-    
-    parser = PDB.PDBParser(QUIET=True)
-    for pdb_file in pdb_files:
-        structure = parser.get_structure('structure', os.path.join(result_subdir, pdb_file))
-        for model in structure:
-            for chain in model:
-                seq_lengths.append(len(chain))
-    
-    return seq_lengths
+    # Every model of a job has the same chains, so one PDB is enough
+    pdb_file = os.path.join(result_subdir, "ranked_0.pdb")
+    if not os.path.exists(pdb_file):
+        pdb_files = sorted(f for f in os.listdir(result_subdir) if f.endswith('.pdb'))
+        if not pdb_files:
+            return []
+        pdb_file = os.path.join(result_subdir, pdb_files[0])
+
+    return list(read_chain_lengths(pdb_file).values())
 
 def obtain_pae_and_iptm(result_subdir, best_model):
-    model_number = int(best_model.split('_')[-1]) + 1
-    file_path = os.path.join(result_subdir, f"result_model_{model_number}_multimer_v3_pred_0.pkl")
+    # ranking_debug.json names models like "model_4_multimer_v3_pred_0"; their pickle is result_<model>.pkl
+    model_name = best_model if best_model.startswith("result_") else f"result_{best_model}"
+    file_path = os.path.join(result_subdir, f"{model_name}.pkl")
     if not os.path.exists(file_path):
         print(f"Error: {file_path} does not exist")
         return None, None
     
-    with open(file_path, 'rb') as f:
-        data = pickle.load(f)
-    
     try:
-        pae_mtx = data['predicted_aligned_error']
+        # Use a zero-copy view and the stored ipTM from the PAE store when it holds this model, otherwise the metric cache
+        job = os.path.basename(os.path.normpath(result_subdir))
+        store = open_pae_store(FLAGS.pae_store_dir) if FLAGS.pae_store_dir else None
+        if store is not None and store.is_current(job, model_name, file_path):
+            data = store.metrics(job, model_name)
+            pae_mtx = store.get(job, model_name)
+        else:
+            data = load_result_metrics(file_path, ('predicted_aligned_error', 'iptm'), cache_dir=FLAGS.metric_cache_dir or None)
+            pae_mtx = data['predicted_aligned_error']
         iptm_score = data['iptm']
         return pae_mtx, iptm_score
     except KeyError:
         print(f"Error: {file_path} does not contain the required keys")
         return None, None
 
+# Function to yield the off-diagonal (inter-chain) blocks of a PAE matrix as views
+def iter_interface_blocks(pae_mtx, seq_lengths):
+    boundaries = np.cumsum([0] + list(seq_lengths))
+    for i in range(len(seq_lengths)):
+        for j in range(len(seq_lengths)):
+            block = pae_mtx[boundaries[i]:boundaries[i + 1], boundaries[j]:boundaries[j + 1]]
+            if i != j and block.size:
+                yield i, j, block
+
 def examine_inter_pae(pae_mtx, seq_lengths, cutoff):
     if pae_mtx is None:
         return False
 
-    old_length = 0
-    for length in seq_lengths:
-        new_length = old_length + length
-        pae_mtx[old_length:new_length, old_length:new_length] = 50
-        old_length = new_length
-    check = np.where(pae_mtx < cutoff)[0].size != 0
-
-    return check
+    # Only the inter-chain blocks are visited, and the matrix is never modified so it can be a
+    # read-only view from the PAE store; a block minimum needs no index or mask arrays
+    for _, _, block in iter_interface_blocks(pae_mtx, seq_lengths):
+        if block.min() < cutoff:
+            return True
+
+    return False
+
+def inspect_inter_pae(pae_mtx, seq_lengths, cutoff):
+    """
+    Return per-interface stats for every pair of chains: the number of residue pairs
+    with PAE below cutoff, the minimum PAE, and the residue ranges (1-based within each
+    chain) that take part in those pairs.
+    """
+    interfaces = []
+    if pae_mtx is None:
+        return interfaces
+
+    for i, j, block in iter_interface_blocks(pae_mtx, seq_lengths):
+        below_cutoff = block < cutoff
+        count = int(np.count_nonzero(below_cutoff))
+        stats = {"chain_1": i + 1, "chain_2": j + 1, "count": count, "min_pae": float(block.min()),
+                 "residues_1": "", "residues_2": ""}
+        if count:
+            rows = np.flatnonzero(below_cutoff.any(axis=1))
+            cols = np.flatnonzero(below_cutoff.any(axis=0))
+            stats["residues_1"] = f"{rows[0] + 1}-{rows[-1] + 1}"
+            stats["residues_2"] = f"{cols[0] + 1}-{cols[-1] + 1}"
+        interfaces.append(stats)
+    return interfaces
 
 def format_path_for_notebook(path):
     return './' + os.path.basename(path)
-ef create_notebook(combo, output_dir, figsize):
-    print("Creating notebook")
-    import nbformat as nbf
 
-    nb = nbf.v4.new_notebook()
+# Function to pre-render the PAE plots of every model of a job to one PNG, reused while the pickles are unchanged
+def render_pae_thumbnail(result_subdir, png_path, figsize=3):
+    pkl_files = sorted(f for f in os.listdir(result_subdir) if RESULT_PKL_PATTERN.match(f))
+    if not pkl_files:
+        return None
+    newest_pkl_mtime = max(os.path.getmtime(os.path.join(result_subdir, f)) for f in pkl_files)
+    if os.path.exists(png_path) and os.path.getmtime(png_path) >= newest_pkl_mtime:
+        return png_path
+
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(1, len(pkl_files), figsize=(figsize * len(pkl_files), figsize), squeeze=False)
+    for ax, pkl_file in zip(axes[0], pkl_files):
+        data = load_result_metrics(os.path.join(result_subdir, pkl_file), ('predicted_aligned_error',),
+                                   cache_dir=FLAGS.metric_cache_dir or None)
+        ax.imshow(data['predicted_aligned_error'], cmap='bwr', vmin=0, vmax=30)
+        ax.set_title(os.path.splitext(pkl_file)[0].replace("result_", ""), fontsize=8)
+        ax.set_xticks([])
+        ax.set_yticks([])
+    fig.tight_layout()
+    os.makedirs(os.path.dirname(png_path), exist_ok=True)
+    fig.savefig(png_path, dpi=100)
+    plt.close(fig)
+    return png_path
+
+def render_pae_thumbnails(jobs, base_path, image_dir):
+    pae_images = {}
+    for job in jobs:
+        png_path = render_pae_thumbnail(os.path.join(base_path, job.strip()), os.path.join(image_dir, f"{job.strip()}.png"))
+        if png_path:
+            pae_images[job] = png_path
+    print(f"PAE plots available as images for {len(pae_images)} of {len(jobs)} jobs")
+    return pae_images
+
+def notebook_setup_cells(nbf):
     output_cells = []
     md_cell = nbf.v4.new_markdown_cell(
         "# A notebook to display all the predictions with good inter-pae scores for IDPs",
@@ -198,7 +281,7 @@ ef create_notebook(combo, output_dir, figsize):
     output_cells.append(import_cell)
 
     # Add the new code cell
-    new_code_cell = nbf.v4.new_code_cell('''
+    setup_code_cell = nbf.v4.new_code_cell('''
 import af2plots
 print("af2plots module imported successfully!")
 
@@ -244,66 +327,110 @@ def custom_load_pickle(file):
 import af2plots.plotter
 af2plots.plotter.pickle.load = custom_load_pickle
 ''')
-    output_cells.append(new_code_cell)
-
-    base_dir = output_dir
-    for i in range(combo.shape[0]):
-        job = combo.iloc[i, 0]
-        iptm_score = combo.iloc[i, -1]
-        title_cell = nbf.v4.new_markdown_cell(f"## {job} with iptm: {iptm_score}")
-        output_cells.append(title_cell)
-        relative_path = f'./{job.strip()}'
-        subtitle1 = nbf.v4.new_markdown_cell(f"### {job} PAE plots")
-        output_cells.append(subtitle1)
+    output_cells.append(setup_code_cell)
+    return output_cells
+
+def job_cells(nbf, job, iptm_score, figsize, output_dir, pae_image=None):
+    output_cells = []
+    title_cell = nbf.v4.new_markdown_cell(f"## {job} with iptm: {iptm_score}")
+    output_cells.append(title_cell)
+    relative_path = f'./{job.strip()}'
+    subtitle1 = nbf.v4.new_markdown_cell(f"### {job} PAE plots")
+    output_cells.append(subtitle1)
+    if pae_image:
+        # Pre-rendered plots are embedded as images, so nothing is recomputed when the page is opened
+        image_cell = nbf.v4.new_markdown_cell(f"![{job} PAE plots]({os.path.relpath(pae_image, output_dir)})")
+        output_cells.append(image_cell)
+    else:
         code_cell_1 = nbf.v4.new_code_cell(f"display_pae_plots('{relative_path}', figsize=({figsize}, {figsize}))")
         output_cells.append(code_cell_1)
-        subtitle2 = nbf.v4.new_markdown_cell(f"### {job} coloured by plddt")
-        output_cells.append(subtitle2)
-
-        code_cell_2 = nbf.v4.new_code_cell(f"parse_results('{relative_path}')")
-        output_cells.append(code_cell_2)
-        subtitle3 = nbf.v4.new_markdown_cell(f"### {job} coloured by chains")
-        output_cells.append(subtitle3)
-        code_cell_3 = nbf.v4.new_code_cell(f"parse_results_colour_chains('{relative_path}')")
-        output_cells.append(code_cell_3)
-    nb["cells"].extend(output_cells)
-    with open(os.path.join(output_dir, "output.ipynb"), "w") as f:
-        nbf.write(nb, f)
-    logging.info("A notebook has been successfully created.")
-    return combo.shape[0]
+    subtitle2 = nbf.v4.new_markdown_cell(f"### {job} coloured by plddt")
+    output_cells.append(subtitle2)
+
+    code_cell_2 = nbf.v4.new_code_cell(f"parse_results('{relative_path}')")
+    output_cells.append(code_cell_2)
+    subtitle3 = nbf.v4.new_markdown_cell(f"### {job} coloured by chains")
+    output_cells.append(subtitle3)
+    code_cell_3 = nbf.v4.new_code_cell(f"parse_results_colour_chains('{relative_path}')")
+    output_cells.append(code_cell_3)
+    return output_cells
+
+def create_notebook(combo, output_dir, figsize, jobs_per_page=0, pae_images=None):
+    print("Creating notebook")
+    import nbformat as nbf
+
+    pae_images = pae_images or {}
+    n_jobs = combo.shape[0]
+    page_size = jobs_per_page if jobs_per_page > 0 else max(n_jobs, 1)
+    page_starts = list(range(0, n_jobs, page_size)) or [0]
+
+    # A single page keeps the original output.ipynb; otherwise output.ipynb becomes an index of the pages
+    page_names = ["output.ipynb"] if len(page_starts) == 1 else [f"output_page_{k + 1:03d}.ipynb" for k in range(len(page_starts))]
+    index_lines = []
+    for page_name, start in zip(page_names, page_starts):
+        nb = nbf.v4.new_notebook()
+        output_cells = notebook_setup_cells(nbf)
+        page_jobs = []
+        for i in range(start, min(start + page_size, n_jobs)):
+            job = combo.iloc[i, 0]
+            iptm_score = combo.iloc[i, -1]
+            output_cells.extend(job_cells(nbf, job, iptm_score, figsize, output_dir, pae_images.get(job)))
+            page_jobs.append(f"{job} (iptm: {iptm_score})")
+        nb["cells"].extend(output_cells)
+        with open(os.path.join(output_dir, page_name), "w") as f:
+            nbf.write(nb, f)
+        index_lines.append(f"- [{page_name}](./{page_name}): " + ", ".join(page_jobs))
+
+    if len(page_names) > 1:
+        index_nb = nbf.v4.new_notebook()
+        index_nb["cells"].append(nbf.v4.new_markdown_cell(
+            f"# Predictions with good inter-pae scores for IDPs\n\n{n_jobs} jobs over {len(page_names)} pages, "
+            f"{page_size} jobs per page, sorted by iptm.\n\n" + "\n".join(index_lines)
+        ))
+        with open(os.path.join(output_dir, "output.ipynb"), "w") as f:
+            nbf.write(index_nb, f)
+    logging.info(f"{len(page_names)} notebook page(s) have been successfully created.")
+    return n_jobs
+
 def main(argv):
     # Count the number of subdirectories listed in file_list.txt
     subdirectory_count = count_subdirectories(FLAGS.file_list_path)
     print(f"Number of subdirectories listed in file_list.txt: {subdirectory_count}")
 
     file_groups = read_file_list(FLAGS.file_list_path)
-    valid_groups, skipped_groups = check_files_exist(file_groups, FLAGS.base_path)
+    valid_groups, skipped_groups = check_files_exist(file_groups, FLAGS.base_path, verbose=FLAGS.verbose_file_check)
     
     # Log the number of valid and skipped groups
     print(f"Number of valid subdirectories: {len(valid_groups)}")
     print(f"Number of skipped subdirectories: {len(skipped_groups)}")
 
-    job_data = collect_job_data(valid_groups, FLAGS.base_path)
+    job_data = collect_job_data(valid_groups, FLAGS.base_path, FLAGS.min_iptm_ptm, FLAGS.score_all_models)
     
     good_jobs = []
     iptm_ptm = []
     iptm = []
+    interface_rows = []
     count = 0
     total_jobs = len(job_data)
-    for job, iptm_ptm_score in job_data:
+    for job, models in job_data:
         logging.info(f"Now processing {job}")
         print(f"Now processing {job}")
         count += 1
         result_subdir = os.path.join(FLAGS.base_path, job.strip())
         seq_lengths = obtain_seq_lengths(result_subdir)
-        best_model = "result_model_1_multimer_v3_pred_0"  # Assuming best model is 1, modify as needed
-        pae_mtx, iptm_score = obtain_pae_and_iptm(result_subdir, best_model)
-        check = examine_inter_pae(pae_mtx, seq_lengths, cutoff=FLAGS.cutoff)
+        # Models are checked best-ranked first; the first one with a good inter-chain PAE qualifies the job
+        for model, iptm_ptm_score in models:
+            pae_mtx, iptm_score = obtain_pae_and_iptm(result_subdir, model)
+            check = examine_inter_pae(pae_mtx, seq_lengths, cutoff=FLAGS.cutoff)
+            if check:
+                break
         if check:
+            for stats in inspect_inter_pae(pae_mtx, seq_lengths, cutoff=FLAGS.cutoff):
+                interface_rows.append({"jobs": job, "model": model, **stats})
             good_jobs.append(job)
             iptm_ptm.append(iptm_ptm_score)
             iptm.append(iptm_score)
-            print(f"Job {job} added to the good jobs list and will be included in the notebook.")
+            print(f"Job {job} ({model}) added to the good jobs list and will be included in the notebook.")
         else:
             print(f"Job {job} does not meet the criteria and will not be included in the notebook.")
         logging.info(f"Done processing {job}. {count} out of {total_jobs} finished.")
@@ -314,8 +441,17 @@ def main(argv):
     pi_score_df["iptm"] = iptm
 
     pi_score_df = pi_score_df.sort_values(by="iptm", ascending=False)
+    if interface_rows:
+        interface_path = os.path.join(FLAGS.notebook_output_dir, "inter_pae_interfaces.csv")
+        pd.DataFrame(interface_rows).to_csv(interface_path, index=False)
+        print(f"Per-interface PAE stats of the good jobs written to {interface_path}")
     if FLAGS.create_notebook:
-        num_jobs_in_notebook = create_notebook(pi_score_df, FLAGS.notebook_output_dir, FLAGS.pae_figsize)
+        pae_images = None
+        if FLAGS.prerender_pae:
+            image_dir = FLAGS.pae_image_dir or os.path.join(FLAGS.notebook_output_dir, "pae_plots")
+            pae_images = render_pae_thumbnails(list(pi_score_df["jobs"]), FLAGS.base_path, image_dir)
+        num_jobs_in_notebook = create_notebook(pi_score_df, FLAGS.notebook_output_dir, FLAGS.pae_figsize,
+                                               FLAGS.jobs_per_page, pae_images)
         print(f"Number of jobs in the notebook: {num_jobs_in_notebook}")
 
     print(f"Number of good jobs: {len(good_jobs)}")
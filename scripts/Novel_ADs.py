@@ -1,10 +1,11 @@
 import os
-import requests
 from Bio import SeqIO
-import time
-import csv
+import json
 import pickle
-from io import StringIO
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from af2_utils import load_result_metrics, DEFAULT_CACHE_DIR
+from alphamissense import AlphaMissenseFetcher, DEFAULT_CACHE_DIR as DEFAULT_AM_CACHE_DIR
 import af2plots
 print("af2plots module imported successfully!")
 import sys
@@ -62,27 +63,37 @@ fasta_dir = "/scratch/alice/b/bg171/FinalProject/FastaFiles"
 dbd_dir = "/scratch/alice/b/bg171/FinalProject/dbd_locations"
 pkl_base_dir = "/scratch/alice/b/bg171/FinalProject/Predictions"  # Base directory containing directories with pkl files
 output_file = "Novel_ADs.csv"
+pkl_index_file = "uniprot_pkl_index.json"  # Saved UniProt ID -> prediction directory index
+debug_trace = False  # Print the AFmissense score and pLDDT of every residue while finding regions
+checkpoint_file = "Novel_ADs.checkpoint"  # FASTA files already written to output_file
+resume = True  # Continue an interrupted run from checkpoint_file instead of starting again
+n_workers = 8  # TFs whose pickles and AlphaMissense scores are loaded concurrently (also the number of concurrent downloads)
+metric_cache_dir = DEFAULT_CACHE_DIR  # Sidecar cache of the pickle metrics (af2_utils); None to always unpickle
+
+# AlphaMissense scores: set alphamissense_offline_dir (a directory of AF-<ID>-F1-aa-substitutions.csv files)
+# or alphamissense_bulk_tsv (AlphaMissense_aa_substitutions.tsv.gz) to run without internet access
+alphamissense_cache_dir = DEFAULT_AM_CACHE_DIR
+alphamissense_offline_dir = None
+alphamissense_bulk_tsv = None
+alphamissense_aggregate = "mean"  # How the 19 substitution scores of a position are combined: mean, max, min or last
+alphamissense_fetcher = AlphaMissenseFetcher(
+    cache_dir=alphamissense_cache_dir,
+    offline_dir=alphamissense_offline_dir,
+    bulk_tsv=alphamissense_bulk_tsv,
+    aggregate=alphamissense_aggregate,
+    rate=5.0,  # Average requests per second to the AlphaFold DB
+)
 
 def download_alphamissense_data(uniprot_id):
-    print(f"Downloading AlphaMissense data for {uniprot_id}")
-    url = f"https://alphafold.ebi.ac.uk/files/AF-{uniprot_id}-F1-aa-substitutions.csv"
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        csv_content = StringIO(response.text)
-        reader = csv.DictReader(csv_content)
-
-        alphamissense_data = {}
-        for row in reader:
-            variant = row['protein_variant']
-            position = int(variant[1:-1])  # Extract position from variant (e.g., "M1A" -> 1)
-            am_pathogenicity = float(row['am_pathogenicity'])
-            alphamissense_data[position] = am_pathogenicity
-
-        print(f"Successfully downloaded data for {uniprot_id}")
+    print(f"Fetching AlphaMissense data for {uniprot_id}")
+    if alphamissense_bulk_tsv:
+        # A zero-copy vector from the bulk index, which identify_regions_with_plddt takes as is
+        alphamissense_data = alphamissense_fetcher.fetch_vector(uniprot_id)
+    else:
+        alphamissense_data = alphamissense_fetcher.fetch(uniprot_id)
+    if alphamissense_data is not None and len(alphamissense_data):
+        print(f"Successfully fetched data for {uniprot_id}")
         return alphamissense_data
-    except requests.exceptions.RequestException as e:
-        print(f"Error downloading data for {uniprot_id}: {e}")
     return None
 
 def parse_location_file(file_path):
@@ -99,134 +110,268 @@ def load_plddt_data_from_pkl(pkl_file_path):
     """
     Load pLDDT scores from the .pkl file.
     """
-    with open(pkl_file_path, 'rb') as f:
-        data = custom_load_pickle(f)
-        plddt_scores = {i + 1: plddt for i, plddt in enumerate(data['plddt'])}
+    data = load_result_metrics(pkl_file_path, ('plddt',), cache_dir=metric_cache_dir)
+    plddt_scores = {i + 1: plddt for i, plddt in enumerate(data['plddt'])}
     return plddt_scores
 
-def find_pkl_file_for_uniprot(pkl_base_dir, uniprot_id):
+def uniprot_id_from_dir_name(dir_name):
+    """
+    Extract the TF UniProt accession from a prediction directory name such as
+    Q09472_320-440_566-661_1018-1840_1660-1840_1900-2100_and_P12345_1-500.
+    """
+    if "_and_" not in dir_name:
+        return None
+    partner = dir_name.split("_and_", 1)[1]
+    return partner.split("_", 1)[0] or None
+
+def build_pkl_index(pkl_base_dir, index_file=pkl_index_file):
+    """
+    Map each UniProt ID to the prediction directories made for it, scanning pkl_base_dir once.
+    The index is saved to index_file and reused while the mtime of pkl_base_dir is unchanged.
+    """
+    base_mtime = os.stat(pkl_base_dir).st_mtime_ns
+    if os.path.exists(index_file):
+        with open(index_file, 'r') as f:
+            saved = json.load(f)
+        if saved.get("base_dir") == os.path.abspath(pkl_base_dir) and saved.get("mtime_ns") == base_mtime:
+            print(f"Loaded .pkl index for {len(saved['index'])} Uniprot IDs from {index_file}")
+            return saved["index"]
+
+    index = {}
+    with os.scandir(pkl_base_dir) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                uniprot_id = uniprot_id_from_dir_name(entry.name)
+                if uniprot_id:
+                    index.setdefault(uniprot_id, []).append(entry.name)
+    for dir_names in index.values():
+        dir_names.sort()
+
+    with open(index_file, 'w') as f:
+        json.dump({"base_dir": os.path.abspath(pkl_base_dir), "mtime_ns": base_mtime, "index": index}, f)
+    print(f"Indexed prediction directories for {len(index)} Uniprot IDs in {pkl_base_dir}")
+    return index
+
+def find_pkl_file_for_uniprot(pkl_base_dir, uniprot_id, pkl_index):
     """
     Find the correct .pkl file for a given Uniprot ID within the pkl_base_dir.
     """
-    # Traverse the base directory
-    for root, dirs, files in os.walk(pkl_base_dir):
-        # Check each subdirectory
-        for dir_name in dirs:
-            # Check if the subdirectory name contains the Uniprot ID
-            if uniprot_id in dir_name:
-                # Construct the full path to the subdirectory
-                subdir_path = os.path.join(root, dir_name)
-                # Construct the expected path to the .pkl file
-                pkl_file_path = os.path.join(subdir_path, "result_model_1_multimer_v3_pred_0.pkl")
-                # Check if the .pkl file exists
-                if os.path.exists(pkl_file_path):
-                    print(f"Found .pkl file for {uniprot_id}: {pkl_file_path}")
-                    return pkl_file_path
+    dir_names = pkl_index.get(uniprot_id, [])
+    if len(dir_names) > 1:
+        print(f"Found {len(dir_names)} prediction directories for {uniprot_id}: {dir_names}")
+    for dir_name in dir_names:
+        pkl_file_path = os.path.join(pkl_base_dir, dir_name, "result_model_1_multimer_v3_pred_0.pkl")
+        # Check if the .pkl file exists
+        if os.path.exists(pkl_file_path):
+            print(f"Found .pkl file for {uniprot_id}: {pkl_file_path}")
+            return pkl_file_path
     # If not found, log a warning and return None
     print(f"No .pkl file found for {uniprot_id}")
     return None
-def identify_regions_with_plddt(alphamissense_data, plddt_data, threshold_high=0.564, threshold_low=0.2, plddt_high=60, plddt_low=50):
+
+def score_arrays(scores):
+    """
+    Return (positions, values) as sorted NumPy arrays for either a {position: score} dict
+    or a vector indexed by position - 1 with NaN for missing positions.
+    """
+    if isinstance(scores, dict):
+        positions = np.array(sorted(scores), dtype=np.int64)
+        values = np.array([scores[position] for position in positions], dtype=np.float64)
+        return positions, values
+    values = np.asarray(scores, dtype=np.float64)
+    positions = np.flatnonzero(~np.isnan(values))
+    return positions + 1, values[positions]
+
+def identify_regions_with_plddt(alphamissense_data, plddt_data, threshold_high=0.564, threshold_low=0.2, plddt_high=60, plddt_low=50, debug=False):
     """
     Identify regions with high AFmissense scores flanked by low AFmissense scores
     and check for the required pLDDT score patterns.
     """
     print("Identifying regions based on AFmissense and pLDDT score criteria")
+    am_positions, am_scores = score_arrays(alphamissense_data)
+    plddt_positions, plddt_scores = score_arrays(plddt_data)
+    if len(am_positions) < 3:
+        print("Identified regions: []")
+        return []
+
+    # Dense per-position arrays (NaN where a position has no score)
+    size = int(max(am_positions[-1], plddt_positions[-1] if len(plddt_positions) else 0)) + 1
+    am_dense = np.full(size, np.nan)
+    am_dense[am_positions] = am_scores
+    plddt_dense = np.full(size, np.nan)
+    plddt_dense[plddt_positions] = plddt_scores
+    # pLDDT at each AFmissense position, 0 where it is missing
+    plddt_at = np.nan_to_num(plddt_dense[am_positions], nan=0.0)
+
+    # Previous/current/next values of every interior AFmissense position via shifted arrays
+    prev_score, current_score, next_score = am_scores[:-2], am_scores[1:-1], am_scores[2:]
+    prev_plddt, current_plddt, next_plddt = plddt_at[:-2], plddt_at[1:-1], plddt_at[2:]
+
+    if debug:
+        for position, score, plddt in zip(am_positions[1:-1], current_score, current_plddt):
+            print(f"Position {position}: AFmissense={score}, pLDDT={plddt}")
+
+    # A region starts at a high score next to a low score with a stable neighbour, and ends at the
+    # first later position that is not a start candidate but drops below the high threshold or
+    # precedes a low score
+    is_start = ((current_score >= threshold_high) &
+                ((prev_score <= threshold_low) | (next_score <= threshold_low)) &
+                ((prev_plddt >= plddt_high) | (next_plddt >= plddt_high)))
+    is_end = ~is_start & ((current_score < threshold_high) | (next_score <= threshold_low))
+    start_indices = np.flatnonzero(is_start)
+    end_indices = np.flatnonzero(is_end)
+
+    # Cumulative sums give each region's mean in O(1); missing positions are counted separately
+    am_cumsum = np.concatenate(([0.0], np.cumsum(np.nan_to_num(am_dense))))
+    am_missing = np.concatenate(([0], np.cumsum(np.isnan(am_dense))))
+    plddt_cumsum = np.concatenate(([0.0], np.cumsum(np.nan_to_num(plddt_dense))))
+    plddt_missing = np.concatenate(([0], np.cumsum(np.isnan(plddt_dense))))
+
+    def region_mean(cumsum, missing, start, end):
+        if missing[end + 1] - missing[start]:
+            return float('nan')
+        return float((cumsum[end + 1] - cumsum[start]) / (end - start + 1))
+
     regions = []
-    keys = sorted(alphamissense_data.keys())
-
-    print(f"AFmissense data keys: {keys[:10]}")  # Print first 10 keys for reference
-    print(f"First 10 pLDDT values: {[plddt_data[k] for k in keys[:10]]}")
-
-    in_high_region = False
-    start = None
-    end = None
-    
-    for i in range(1, len(keys) - 1):
-        prev_score = alphamissense_data[keys[i - 1]]
-        current_score = alphamissense_data[keys[i]]
-        next_score = alphamissense_data[keys[i + 1]]
-
-        prev_plddt = plddt_data.get(keys[i - 1], 0)
-        current_plddt = plddt_data.get(keys[i], 0)
-        next_plddt = plddt_data.get(keys[i + 1], 0)
-
-        print(f"Position {keys[i]}: AFmissense={current_score}, pLDDT={current_plddt}")
-
-        # Adjusted condition: focus on identifying high AFmissense regions, possibly flanked by stable pLDDT
-        if (current_score >= threshold_high and 
-            (prev_score <= threshold_low or next_score <= threshold_low) and
-            (prev_plddt >= plddt_high or next_plddt >= plddt_high)):
-            if not in_high_region:
-                start = keys[i]
-                in_high_region = True
-        elif in_high_region and (current_score < threshold_high or next_score <= threshold_low):
-            end = keys[i]
-            if start is not None and end is not None:
-                avg_afmissense = sum(alphamissense_data[j] for j in range(start, end + 1)) / (end - start + 1)
-                avg_plddt = sum(plddt_data[j] for j in range(start, end + 1)) / (end - start + 1)
-                regions.append((start, end, avg_afmissense, avg_plddt))
-            in_high_region = False
-            start = None
-            end = None
+    i = 0
+    while True:
+        s = np.searchsorted(start_indices, i)
+        if s == len(start_indices):
+            break
+        start_index = start_indices[s]
+        e = np.searchsorted(end_indices, start_index, side='right')
+        if e == len(end_indices):
+            break  # A region still open at the last position is not reported
+        end_index = end_indices[e]
+        start = int(am_positions[start_index + 1])
+        end = int(am_positions[end_index + 1])
+        regions.append((start, end,
+                        region_mean(am_cumsum, am_missing, start, end),
+                        region_mean(plddt_cumsum, plddt_missing, start, end)))
+        i = end_index + 1
 
     print(f"Identified regions: {regions}")
     return regions
 
+def load_tf_inputs(filename, pkl_index):
+    """
+    I/O stage for one TF: read the FASTA and DBD files, load the pLDDT scores and fetch the
+    AlphaMissense scores. Returns (tf_inputs, final): tf_inputs is None if the TF cannot be
+    analysed, and final is False when that is down to AlphaMissense scores that a later run
+    may still be able to download (never in offline mode, where a missing protein stays missing).
+    """
+    tf_name, uniprot_id = filename.split("_")
+    uniprot_id = uniprot_id[:-3]  # Remove .fa
+    print(f"Processing {filename}")
+
+    # Read FASTA sequence
+    fasta_path = os.path.join(fasta_dir, filename)
+    try:
+        with open(fasta_path, 'r') as fasta_file:
+            seq_record = next(SeqIO.parse(fasta_file, "fasta"))
+            print(f"Parsed sequence of {filename}: {seq_record.seq[:50]}...")  # Print first 50 characters
+    except StopIteration:
+        print(f"Error: Empty or invalid FASTA file: {fasta_path}")
+        return None, True
+
+    # Get DBD locations
+    dbd_file = os.path.join(dbd_dir, f"{filename}.dbd_locations.txt")
+    if not os.path.exists(dbd_file):
+        print(f"Warning: DBD file not found: {dbd_file}")
+        dbd_locations = []
+    else:
+        dbd_locations = parse_location_file(dbd_file)
+
+    # Find the corresponding pkl file
+    pkl_file = find_pkl_file_for_uniprot(pkl_base_dir, uniprot_id, pkl_index)
+    if not pkl_file:
+        print(f"Warning: PKL file not found for Uniprot ID {uniprot_id}")
+        return None, True
+
+    # Load pLDDT scores from the pkl file
+    plddt_data = load_plddt_data_from_pkl(pkl_file)
+
+    # Fetch AlphaMissense data
+    alphamissense_data = download_alphamissense_data(uniprot_id)
+    if alphamissense_data is None:
+        print(f"Warning: No AlphaMissense data found for {uniprot_id}")
+        # Only a download can succeed on a later run; the offline directory or bulk file will not change
+        return None, alphamissense_fetcher.offline
+
+    return {"tf_name": tf_name, "uniprot_id": uniprot_id, "dbd_locations": dbd_locations,
+            "plddt_data": plddt_data, "alphamissense_data": alphamissense_data}, True
+
+def read_checkpoint(checkpoint_path):
+    if not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path, 'r') as f:
+        return {line.strip() for line in f if line.strip()}
+
+def restore_output(output_path, done_files):
+    """
+    Keep only the rows of TFs recorded as finished in the checkpoint, so a TF interrupted
+    half-way through writing its rows is redone without duplicates. A partly written last
+    line (no newline, or too few fields) is dropped too.
+    """
+    rows = []
+    with open(output_path, 'r') as f:
+        header = f.readline()
+        for line in f:
+            fields = line.split("\t")
+            if line.endswith("\n") and len(fields) >= 2 and "{}_{}.fa".format(*fields[:2]) in done_files:
+                rows.append(line)
+    with open(output_path, 'w') as f:
+        f.write(header)
+        f.writelines(rows)
+
 def main():
-    with open(output_file, 'w') as out_f:
-        out_f.write("TF\tUniprotID\tRegion\tAverage_AFmissense\tAverage_pLDDT\n")
-
-        for filename in os.listdir(fasta_dir):
-            if filename.endswith(".fa"):
-                tf_name, uniprot_id = filename.split("_")
-                uniprot_id = uniprot_id[:-3]  # Remove .fa
-                print(f"\nProcessing {filename}")
-
-                # Read FASTA sequence
-                fasta_path = os.path.join(fasta_dir, filename)
-                try:
-                    with open(fasta_path, 'r') as fasta_file:
-                        content = fasta_file.read()
-                        print(f"Content of {fasta_path}:")
-                        print(content)
-                        fasta_file.seek(0)  # Reset file pointer to the beginning
-                        seq_record = next(SeqIO.parse(fasta_file, "fasta"))
-                        print(f"Parsed sequence: {seq_record.seq[:50]}...")  # Print first 50 characters
-                except StopIteration:
-                    print(f"Error: Empty or invalid FASTA file: {fasta_path}")
-                    continue
-
-                # Get DBD locations
-                dbd_file = os.path.join(dbd_dir, f"{filename}.dbd_locations.txt")
-                if not os.path.exists(dbd_file):
-                    print(f"Warning: DBD file not found: {dbd_file}")
-                    dbd_locations = []
-                else:
-                    dbd_locations = parse_location_file(dbd_file)
-
-                # Find the corresponding pkl file
-                pkl_file = find_pkl_file_for_uniprot(pkl_base_dir, uniprot_id)
-                if not pkl_file:
-                    print(f"Warning: PKL file not found for Uniprot ID {uniprot_id}")
-                    continue
-
-                # Load pLDDT scores from the pkl file
-                plddt_data = load_plddt_data_from_pkl(pkl_file)
-
-                # Download AlphaMissense data
-                alphamissense_data = download_alphamissense_data(uniprot_id)
-
-                if alphamissense_data:
-                    # Identify regions based on AFmissense and pLDDT criteria
-                    regions = identify_regions_with_plddt(alphamissense_data, plddt_data)
-
-                    for start, end, avg_afmissense, avg_plddt in regions:
-                        out_f.write(f"{tf_name}\t{uniprot_id}\t{start}-{end}\t{avg_afmissense:.4f}\t{avg_plddt:.4f}\n")
-                else:
-                    print(f"Warning: No AlphaMissense data found for {uniprot_id}")
-
-                # Add a delay to avoid overwhelming the API
-                time.sleep(1)
+    pkl_index = build_pkl_index(pkl_base_dir)
+    fasta_files = sorted(filename for filename in os.listdir(fasta_dir) if filename.endswith(".fa"))
+
+    # Resume from the checkpoint of an interrupted run, or start a fresh output file
+    if resume and os.path.exists(output_file) and os.path.exists(checkpoint_file):
+        done_files = read_checkpoint(checkpoint_file)
+        restore_output(output_file, done_files)
+        print(f"Resuming: {len(done_files)} of {len(fasta_files)} TFs already finished")
+    else:
+        done_files = set()
+        with open(output_file, 'w') as out_f:
+            out_f.write("TF\tUniprotID\tRegion\tAverage_AFmissense\tAverage_pLDDT\n")
+        open(checkpoint_file, 'w').close()
+    pending_files = [filename for filename in fasta_files if filename not in done_files]
+
+    if alphamissense_bulk_tsv:
+        alphamissense_fetcher.position_index  # Build or open the bulk index once, before the workers start
+
+    # Worker threads load each TF's inputs (pickle and AlphaMissense I/O) while this thread finds
+    # regions and streams the rows of every finished TF to the output file
+    with open(output_file, 'a') as out_f, open(checkpoint_file, 'a') as checkpoint_f, \
+            ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = {executor.submit(load_tf_inputs, filename, pkl_index): filename for filename in pending_files}
+        for count, future in enumerate(as_completed(futures), start=1):
+            filename = futures[future]
+            try:
+                tf_inputs, final = future.result()
+            except Exception as e:
+                print(f"Error processing {filename}: {e}")
+                continue
+            if not final:
+                # Left out of the checkpoint so a resumed run tries to fetch its AlphaMissense scores again
+                print(f"Skipped {filename} for now ({count} of {len(pending_files)})")
+                continue
+
+            if tf_inputs:
+                # Identify regions based on AFmissense and pLDDT criteria
+                regions = identify_regions_with_plddt(tf_inputs["alphamissense_data"], tf_inputs["plddt_data"], debug=debug_trace)
+                for start, end, avg_afmissense, avg_plddt in regions:
+                    out_f.write(f"{tf_inputs['tf_name']}\t{tf_inputs['uniprot_id']}\t{start}-{end}\t{avg_afmissense:.4f}\t{avg_plddt:.4f}\n")
+                out_f.flush()
+
+            # TFs without a prediction, a valid FASTA or offline AlphaMissense scores are recorded too,
+            # so a resumed run does not retry them
+            checkpoint_f.write(f"{filename}\n")
+            checkpoint_f.flush()
+            print(f"Finished {filename} ({count} of {len(pending_files)})")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Shared helpers for reading AlphaFold-Multimer result pickles and models.
+
+The result_model_*_multimer_v3_pred_*.pkl files are hundreds of MB each, but the
+analysis scripts only need a handful of arrays from them. load_result_metrics
+unpickles a result once and keeps those arrays in a compact .npz sidecar cache,
+so later runs of LIS.py, Notebook.py or Novel_ADs.py read only what they need.
+"""
+
+import os
+import io
+import pickle
+import hashlib
+import zipfile
+import numpy as np
+
+# Metrics kept in the sidecar cache for each result pickle
+RESULT_METRIC_KEYS = ('predicted_aligned_error', 'plddt', 'iptm', 'ptm', 'ranking_confidence')
+
+# The cache lives on scratch next to the predictions, since it holds one PAE matrix per result pickle.
+# A size cap (in bytes) only helps if it holds the sidecars of the whole screen; by default there is none.
+DEFAULT_CACHE_DIR = os.environ.get("AF2_METRIC_CACHE_DIR", "/scratch/alice/b/bg171/FinalProject/af2_metric_cache")
+DEFAULT_CACHE_MAX_BYTES = int(os.environ.get("AF2_METRIC_CACHE_MAX_BYTES", 0)) or None
+
+# Eviction rescans the cache directory only when the running size estimate of this process exceeds
+# the cap, or every CACHE_RESCAN_WRITES writes to pick up what other processes have written
+CACHE_RESCAN_WRITES = 1000
+CACHE_EVICT_FRACTION = 0.9
+_cache_sizes = {}
+
+class DummyJaxArray:
+    def __init__(self, *args, **kwargs):
+        self.shape = args[0] if args else None
+        self.dtype = kwargs.get('dtype', None)
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def __array__(self):
+        if self.shape:
+            return np.zeros(self.shape)
+        return np.array([])
+
+class CustomUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if module == "jax._src.device_array":
+            return DummyJaxArray
+        return super().find_class(module, name)
+
+def custom_load_pickle(file):
+    if isinstance(file, (str, bytes, os.PathLike)):
+        with open(file, 'rb') as f:
+            return CustomUnpickler(f).load()
+    elif isinstance(file, io.IOBase):
+        return CustomUnpickler(file).load()
+    else:
+        raise TypeError(f"Unsupported file type: {type(file)}")
+
+# Function to build the sidecar path of a pickle, keyed by its path, mtime and size
+def metric_cache_path(pkl_file_path, cache_dir=DEFAULT_CACHE_DIR):
+    stat = os.stat(pkl_file_path)
+    key = f"{os.path.abspath(pkl_file_path)}:{stat.st_mtime_ns}:{stat.st_size}"
+    digest = hashlib.sha1(key.encode()).hexdigest()
+    return os.path.join(cache_dir, f"{digest}.npz")
+
+# Function to delete the least recently used sidecars until the cache fits in max_bytes; returns the remaining size
+def evict_metric_cache(cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+    entries = []
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if entry.name.endswith('.npz'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if max_bytes is None or total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # Already evicted by another process
+        total_bytes -= size
+    return total_bytes
+
+def _unwrap(metrics):
+    # Scalars are stored as 0-d arrays; hand them back as plain floats
+    return {key: (value.item() if value.ndim == 0 else value) for key, value in metrics.items()}
+
+def _read_metric_cache(cache_path, keys):
+    try:
+        with np.load(cache_path) as cached:
+            if not all(key in cached.files for key in keys):
+                return None
+            metrics = {key: cached[key] for key in keys}
+    except (FileNotFoundError, ValueError, OSError, zipfile.BadZipFile):
+        return None
+    # Touch the sidecar so eviction treats it as recently used
+    try:
+        os.utime(cache_path)
+    except FileNotFoundError:
+        pass
+    return metrics
+
+def _write_metric_cache(cache_path, metrics, max_bytes):
+    cache_dir = os.path.dirname(cache_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to a private temporary file first so concurrent readers never see a partial sidecar
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **metrics)
+    os.replace(tmp_path, cache_path)
+    if not max_bytes:
+        return
+    # [estimated bytes, writes since the last scan], tracked per cache directory
+    state = _cache_sizes.get(cache_dir)
+    if state is not None and state[1] < CACHE_RESCAN_WRITES:
+        state[0] += os.path.getsize(cache_path)
+        state[1] += 1
+        if state[0] <= max_bytes:
+            return
+    # Evict below the cap so the next few writes do not trigger another scan
+    _cache_sizes[cache_dir] = [evict_metric_cache(cache_dir, int(max_bytes * CACHE_EVICT_FRACTION)), 0]
+
+def load_result_metrics(pkl_file_path, keys=RESULT_METRIC_KEYS, cache_dir=DEFAULT_CACHE_DIR, max_cache_bytes=DEFAULT_CACHE_MAX_BYTES):
+    """
+    Return the requested metrics of an AlphaFold result pickle as a dict.
+
+    The pickle is only unpickled on a cache miss; pass cache_dir=None to bypass the cache.
+    If the sidecar cannot be written (e.g. scratch is full) a warning is printed and the
+    metrics are still returned.
+    Raises KeyError if the pickle does not contain one of the requested keys.
+    """
+    keys = tuple(keys)
+    cache_path = metric_cache_path(pkl_file_path, cache_dir) if cache_dir else None
+    if cache_path:
+        metrics = _read_metric_cache(cache_path, keys)
+        if metrics is not None:
+            return _unwrap(metrics)
+
+    data = custom_load_pickle(pkl_file_path)
+    metrics = {key: np.asarray(data[key]) for key in RESULT_METRIC_KEYS if data.get(key) is not None}
+    if cache_path:
+        # The cache only saves time, so a cache directory that cannot be written never fails the read
+        try:
+            _write_metric_cache(cache_path, metrics, max_cache_bytes)
+        except OSError as e:
+            print(f"Warning: could not write the metric cache for {pkl_file_path}: {e}")
+            try:
+                os.remove(f"{cache_path}.{os.getpid()}.tmp")
+            except OSError:
+                pass
+    return _unwrap({key: metrics[key] for key in keys})
+
+def read_chain_lengths(pdb_file_path):
+    """
+    Return {chain_id: number_of_residues} for the first model of a PDB file.
+
+    Streams the ATOM/HETATM records instead of building a Bio.PDB structure, which is
+    all that is needed to find the chain boundaries in a PAE matrix.
+    """
+    chain_residues = {}
+    with open(pdb_file_path, 'r') as f:
+        for line in f:
+            if line.startswith(("ATOM  ", "HETATM")):
+                # Residue number plus insertion code identify a residue within its chain
+                chain_residues.setdefault(line[21], set()).add(line[22:27])
+            elif line.startswith("ENDMDL"):
+                break
+    return {chain_id: len(residues) for chain_id, residues in chain_residues.items()}
+
+def read_chain_atoms(pdb_file_path, chain_ids):
+    """
+    Return {chain_id: (resids, atom_names, coordinates)} of the ATOM records of the requested
+    chains in the first model of a PDB file.
+
+    Streams the file once like read_chain_lengths, so every domain window of a model can be
+    sliced from one read instead of building an MDAnalysis Universe (or rereading) for each.
+    """
+    atoms = {chain_id: ([], [], []) for chain_id in chain_ids}
+    with open(pdb_file_path, 'r') as f:
+        for line in f:
+            if line.startswith("ATOM  ") and line[21] in atoms:
+                resids, names, coords = atoms[line[21]]
+                resids.append(int(line[22:26]))
+                names.append(line[12:16].strip())
+                coords.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+            elif line.startswith("ENDMDL"):
+                break
+    return {chain_id: (np.array(resids, dtype=np.int64), np.array(names, dtype=str), np.array(coords, dtype=np.float32).reshape(-1, 3))
+            for chain_id, (resids, names, coords) in atoms.items()}
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Concurrent, cached access to the per-position AlphaMissense pathogenicity scores of a protein.
+
+Scores are downloaded from the AlphaFold DB substitutions CSVs in the caller's threads through a
+shared token-bucket rate limiter (the caller's thread count sets the download concurrency), and the parsed {position: score} map of every protein is kept
+in an on-disk JSON cache so reruns never hit the network. In offline mode the scores are read
+from a directory of pre-downloaded AF-<ID>-F1-aa-substitutions.csv files, or from the bulk
+AlphaMissense_aa_substitutions.tsv(.gz) file, instead of the web.
+
+The bulk file (tens of millions of rows) is streamed once into a memory-mapped index holding one
+score per position for every protein. The 19 substitution scores of a position are reduced with
+an explicit aggregate: 'mean' (default), 'max', 'min' or 'last' (the score listed last).
+"""
+
+import os
+import csv
+import gzip
+import json
+import threading
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+import requests
+
+from fetch_utils import TokenBucket, get_with_retries
+
+AF_SUBSTITUTIONS_URL = "https://alphafold.ebi.ac.uk/files/AF-{uniprot_id}-F1-aa-substitutions.csv"
+SCORES_NAME = "alphamissense_scores.bin"
+INDEX_NAME = "alphamissense_index.json"
+DEFAULT_CACHE_DIR = os.environ.get(
+    "ALPHAMISSENSE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "alphamissense")
+)
+
+# Ways of reducing the 19 substitution scores of a position to one value
+AGGREGATES = ('mean', 'max', 'min', 'last')
+
+def parse_substitution_rows(rows, aggregate='mean'):
+    """Reduce substitution rows (protein_variant, am_pathogenicity) to {position: score}."""
+    if aggregate not in AGGREGATES:
+        raise ValueError(f"Unknown aggregate {aggregate!r}, expected one of {AGGREGATES}")
+    scores = {}
+    for row in rows:
+        variant = row['protein_variant']
+        position = int(variant[1:-1])  # Extract position from variant (e.g., "M1A" -> 1)
+        scores.setdefault(position, []).append(float(row['am_pathogenicity']))
+    if aggregate == 'mean':
+        return {position: sum(values) / len(values) for position, values in scores.items()}
+    if aggregate == 'max':
+        return {position: max(values) for position, values in scores.items()}
+    if aggregate == 'min':
+        return {position: min(values) for position, values in scores.items()}
+    return {position: values[-1] for position, values in scores.items()}
+
+def open_text(path):
+    return gzip.open(path, 'rt') if path.endswith('.gz') else open(path, 'r')
+
+def build_position_index(bulk_tsv, index_dir, aggregate='mean', chunksize=2_000_000):
+    """
+    Stream the bulk AlphaMissense substitutions TSV in chunks and write one score per position
+    for every protein to a memory-mappable index (see AlphaMissenseIndex).
+    """
+    if aggregate not in AGGREGATES:
+        raise ValueError(f"Unknown aggregate {aggregate!r}, expected one of {AGGREGATES}")
+    # Running per-protein reductions; these are tiny next to the bulk file (one value per residue)
+    totals, counts, reduced = {}, {}, {}
+
+    def grow(arrays, uniprot_id, length, fill):
+        array = arrays.get(uniprot_id)
+        if array is None or len(array) < length:
+            grown = np.full(length, fill)
+            if array is not None:
+                grown[:len(array)] = array
+            arrays[uniprot_id] = array = grown
+        return array
+
+    reader = pd.read_csv(bulk_tsv, sep='\t', comment='#', usecols=['uniprot_id', 'protein_variant', 'am_pathogenicity'],
+                         dtype={'uniprot_id': str, 'protein_variant': str, 'am_pathogenicity': np.float64},
+                         chunksize=chunksize)
+    for chunk in reader:
+        chunk['position'] = chunk['protein_variant'].str.slice(1, -1).astype(np.int64)
+        grouped = chunk.groupby(['uniprot_id', 'position'], sort=False)['am_pathogenicity']
+        if aggregate == 'mean':
+            stats = grouped.agg(['sum', 'count'])
+        else:
+            stats = grouped.agg(aggregate).to_frame('value')
+        for uniprot_id, protein_stats in stats.groupby(level=0, sort=False):
+            positions = protein_stats.index.get_level_values(1).to_numpy() - 1
+            length = int(positions.max()) + 1
+            if aggregate == 'mean':
+                grow(totals, uniprot_id, length, 0.0)[positions] += protein_stats['sum'].to_numpy()
+                grow(counts, uniprot_id, length, 0)[positions] += protein_stats['count'].to_numpy()
+                continue
+            values = protein_stats['value'].to_numpy()
+            array = grow(reduced, uniprot_id, length, np.nan)
+            if aggregate == 'max':
+                array[positions] = np.fmax(array[positions], values)
+            elif aggregate == 'min':
+                array[positions] = np.fmin(array[positions], values)
+            else:
+                array[positions] = values
+
+    if aggregate == 'mean':
+        for uniprot_id, total in totals.items():
+            count = counts[uniprot_id]
+            reduced[uniprot_id] = np.divide(total, count, out=np.full(len(total), np.nan), where=count > 0)
+
+    os.makedirs(index_dir, exist_ok=True)
+    index = {}
+    offset = 0
+    with open(os.path.join(index_dir, SCORES_NAME), 'wb') as f:
+        for uniprot_id in sorted(reduced):
+            values = reduced[uniprot_id].astype(np.float32)
+            f.write(values.tobytes())
+            index[uniprot_id] = [offset, len(values)]
+            offset += len(values)
+    stat = os.stat(bulk_tsv)
+    with open(os.path.join(index_dir, INDEX_NAME), 'w') as f:
+        json.dump({"source": os.path.abspath(bulk_tsv), "mtime_ns": stat.st_mtime_ns, "size": stat.st_size,
+                   "aggregate": aggregate, "proteins": index}, f)
+    print(f"Indexed AlphaMissense scores of {len(index)} proteins from {bulk_tsv}")
+    return AlphaMissenseIndex(index_dir)
+
+class AlphaMissenseIndex:
+    """
+    Per-position AlphaMissense scores of every protein in one float32 memory map, with
+    missing positions stored as NaN. get() returns a zero-copy vector indexed by position - 1.
+    """
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, INDEX_NAME), 'r') as f:
+            self.meta = json.load(f)
+        self.proteins = self.meta["proteins"]
+        scores_path = os.path.join(index_dir, SCORES_NAME)
+        self.scores = np.memmap(scores_path, dtype=np.float32, mode='r') if os.path.getsize(scores_path) else np.zeros(0, np.float32)
+
+    def __contains__(self, uniprot_id):
+        return uniprot_id in self.proteins
+
+    def is_current(self, bulk_tsv, aggregate):
+        stat = os.stat(bulk_tsv)
+        return (self.meta["source"] == os.path.abspath(bulk_tsv) and self.meta["mtime_ns"] == stat.st_mtime_ns
+                and self.meta["size"] == stat.st_size and self.meta["aggregate"] == aggregate)
+
+    def get(self, uniprot_id):
+        offset, length = self.proteins[uniprot_id]
+        return self.scores[offset:offset + length]
+
+    def get_dict(self, uniprot_id):
+        vector = self.get(uniprot_id)
+        positions = np.flatnonzero(~np.isnan(vector))
+        return dict(zip((positions + 1).tolist(), vector[positions].astype(float).tolist()))
+
+def open_position_index(bulk_tsv, index_dir, aggregate='mean'):
+    """Open the position index of bulk_tsv, (re)building it if it is missing or out of date."""
+    if os.path.exists(os.path.join(index_dir, INDEX_NAME)):
+        position_index = AlphaMissenseIndex(index_dir)
+        if position_index.is_current(bulk_tsv, aggregate):
+            return position_index
+    return build_position_index(bulk_tsv, index_dir, aggregate)
+
+class AlphaMissenseFetcher:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, offline_dir=None, bulk_tsv=None, aggregate='mean',
+                 rate=5.0, burst=5, url_template=AF_SUBSTITUTIONS_URL):
+        if aggregate not in AGGREGATES:
+            raise ValueError(f"Unknown aggregate {aggregate!r}, expected one of {AGGREGATES}")
+        self.cache_dir = cache_dir
+        self.aggregate = aggregate
+        self._position_index = None
+        self._position_index_lock = threading.Lock()
+        self.offline_dir = offline_dir
+        self.bulk_tsv = bulk_tsv
+        self.rate_limiter = TokenBucket(rate, burst)
+        self.url_template = url_template
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @property
+    def offline(self):
+        return bool(self.offline_dir or self.bulk_tsv)
+
+    def _cache_path(self, uniprot_id):
+        return os.path.join(self.cache_dir, f"{uniprot_id}.{self.aggregate}.json")
+
+    def load_cached(self, uniprot_id):
+        if not self.cache_dir or not os.path.exists(self._cache_path(uniprot_id)):
+            return None
+        with open(self._cache_path(uniprot_id), 'r') as f:
+            return {int(position): score for position, score in json.load(f).items()}
+
+    def save_cached(self, uniprot_id, alphamissense_data):
+        if not self.cache_dir:
+            return
+        tmp_path = f"{self._cache_path(uniprot_id)}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(alphamissense_data, f)
+        os.replace(tmp_path, self._cache_path(uniprot_id))
+
+    def _download(self, uniprot_id):
+        url = self.url_template.format(uniprot_id=uniprot_id)
+        try:
+            response = get_with_retries(url, self.rate_limiter)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            print(f"Error downloading data for {uniprot_id}: {e}")
+            return None
+        return parse_substitution_rows(csv.DictReader(StringIO(response.text)), self.aggregate)
+
+    def _read_offline_dir(self, uniprot_id):
+        for filename in (f"AF-{uniprot_id}-F1-aa-substitutions.csv", f"AF-{uniprot_id}-F1-aa-substitutions.csv.gz"):
+            path = os.path.join(self.offline_dir, filename)
+            if os.path.exists(path):
+                with open_text(path) as f:
+                    return parse_substitution_rows(csv.DictReader(f), self.aggregate)
+        return None
+
+    @property
+    def position_index(self):
+        """Memory-mapped index of the bulk TSV, built in the cache directory on first use."""
+        with self._position_index_lock:
+            if self._position_index is None:
+                index_dir = os.path.join(self.cache_dir or os.path.dirname(os.path.abspath(self.bulk_tsv)), f"bulk_index_{self.aggregate}")
+                self._position_index = open_position_index(self.bulk_tsv, index_dir, self.aggregate)
+        return self._position_index
+
+    def fetch_vector(self, uniprot_id):
+        """Return the scores of one protein from the bulk index as a vector indexed by position - 1."""
+        if uniprot_id not in self.position_index:
+            return None
+        return self.position_index.get(uniprot_id)
+
+    def fetch(self, uniprot_id):
+        """
+        Return {position: am_pathogenicity} for one protein, or None if no data is available.
+        Runs in the calling thread; callers fetching from several threads share the rate limiter.
+        """
+        if self.bulk_tsv:
+            return self.position_index.get_dict(uniprot_id) if uniprot_id in self.position_index else None
+        alphamissense_data = self.load_cached(uniprot_id)
+        if alphamissense_data is None:
+            alphamissense_data = self._read_offline_dir(uniprot_id) if self.offline_dir else self._download(uniprot_id)
+            if not alphamissense_data:
+                return None
+            self.save_cached(uniprot_id, alphamissense_data)
+        return alphamissense_data
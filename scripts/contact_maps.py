@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Residue contact maps for the p300 domain conformation scripts.
+
+Contacts are found with a KD-tree capped-distance search instead of a Python loop over
+every pair of atoms, and each map is kept as a boolean scipy sparse matrix rather than a
+dense float64 array. Contacts can be defined between CA atoms ("ca") or between any heavy
+atoms of two residues ("heavy").
+"""
+
+import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+CONTACT_MODES = ("ca", "heavy")
+
+def residue_contacts(positions, residue_index, n_residues, cutoff=5.0):
+    """
+    Return a symmetric boolean sparse (n_residues x n_residues) matrix of the residues with
+    any pair of atoms closer than cutoff (strictly, as in the original contact maps).
+    residue_index gives the residue (0..n_residues-1) of each row of positions.
+    """
+    tree = cKDTree(positions)
+    atom_pairs = tree.query_pairs(np.nextafter(cutoff, 0), output_type='ndarray')
+    residue_pairs = residue_index[atom_pairs] if len(atom_pairs) else np.empty((0, 2), dtype=np.int64)
+    residue_pairs = residue_pairs[residue_pairs[:, 0] != residue_pairs[:, 1]]
+    rows = np.concatenate([residue_pairs[:, 0], residue_pairs[:, 1]])
+    cols = np.concatenate([residue_pairs[:, 1], residue_pairs[:, 0]])
+    contacts = sparse.coo_matrix((np.ones(len(rows), dtype=bool), (rows, cols)), shape=(n_residues, n_residues))
+    # Duplicate (heavy-atom) pairs are summed on conversion, which is still True for a bool matrix
+    return contacts.tocsr()
+
+def compute_contact_map(atom_group, cutoff=5.0, mode="ca"):
+    """
+    Contact map of the residues of an MDAnalysis AtomGroup, indexed in residue order.
+
+    In "ca" mode the map is indexed by the CA atoms of the group; in "heavy" mode two residues
+    are in contact if any of their non-hydrogen atoms are closer than cutoff.
+    """
+    if mode not in CONTACT_MODES:
+        raise ValueError(f"Unknown contact mode {mode!r}, expected one of {CONTACT_MODES}")
+    if mode == "ca":
+        atoms = atom_group.select_atoms("name CA")
+        return residue_contacts(atoms.positions, np.arange(len(atoms)), len(atoms), cutoff)
+
+    atoms = atom_group.select_atoms("not name H*")
+    _, residue_index = np.unique(atoms.resindices, return_inverse=True)
+    n_residues = int(residue_index.max()) + 1 if len(atoms) else 0
+    return residue_contacts(atoms.positions, residue_index, n_residues, cutoff)
@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""
+Conformation analysis of named p300 domains in AlphaFold2 models.
+
+Every ranked_0.pdb under the predictions directory is parsed once and compared with the
+reference structure for each domain in the list: RMSD over the residues common to both,
+CA-CA distances between key residue pairs and a residue contact map. TAZ2_domain.py and
+ActiveSite_p300.py run this for a single domain; run this script directly to analyse
+several domains in one pass over the structures.
+"""
+
+import os
+import argparse
+import collections
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import MDAnalysis as mda
+import matplotlib.pyplot as plt
+import seaborn as sns
+
+from af2_utils import read_chain_atoms
+from contact_maps import compute_contact_map, residue_contacts, CONTACT_MODES
+from superposition import batch_rmsd, grouped_rmsd, RMSD_MODES
+
+# A p300 domain window: residues resid_range of segment segid in the models and ref_segid in the reference
+Domain = collections.namedtuple("Domain", ["name", "resid_range", "key_residue_pairs", "segid", "ref_segid"],
+                                defaults=("B", "A"))
+
+# Known domains; add new windows here to analyse them alongside these
+DOMAINS = {
+    "TAZ2": Domain("TAZ2", "1724:1840", [(1724, 1840)]),
+    "HAT": Domain("HAT", "1436:1831", [(1436, 1831)]),
+}
+
+# Model files compared per complex in the all-models mode
+MODEL_SETS = ("ranked", "unrelaxed")
+
+# Function to reduce a CA selection to one atom per residue: sorted resids and the matching coordinates
+def ca_coordinates(ca_atoms):
+    # np.unique keeps the first atom of a duplicated residue, as the old AtomGroup de-duplication did
+    resids, first_index = np.unique(ca_atoms.resids, return_index=True)
+    return resids, ca_atoms.positions[first_index]
+
+def common_coordinates(ref_resids, ref_coords, target_resids, target_coords):
+    """
+    Match two ca_coordinates() results on their common residues.
+    Returns (common_resids, ref_common_coords, target_common_coords).
+    """
+    common_resids, ref_index, target_index = np.intersect1d(ref_resids, target_resids, assume_unique=True, return_indices=True)
+    return common_resids, ref_coords[ref_index], target_coords[target_index]
+
+# Function to measure the CA-CA distance between two residues, or None if either is missing
+def ca_distance(universe, segid, resid1, resid2):
+    atom1 = universe.select_atoms(f"segid {segid} and resid {resid1} and name CA")
+    atom2 = universe.select_atoms(f"segid {segid} and resid {resid2} and name CA")
+    if len(atom1) > 0 and len(atom2) > 0:
+        return float(np.linalg.norm(atom1.positions[0] - atom2.positions[0]))
+    return None
+
+def load_reference(reference_pdb, domains, contact_cutoff=5.0, contact_mode="ca", verbose=True):
+    """Parse the reference once and return {domain name: CA atoms, key distances and contact map}."""
+    ref_universe = mda.Universe(reference_pdb)
+    references = {}
+    for domain in domains:
+        ref_atoms = ref_universe.select_atoms(f"segid {domain.ref_segid} and resid {domain.resid_range} and name CA")
+        distances = []
+        for resid1, resid2 in domain.key_residue_pairs:
+            distance = ca_distance(ref_universe, domain.ref_segid, resid1, resid2)
+            if distance is not None:
+                distances.append((resid1, resid2, distance))
+                if verbose:
+                    print(f"Reference {domain.name} distance between residue {resid1} and {resid2}: {distance:.2f} Å")
+        ref_resids, ref_coords = ca_coordinates(ref_atoms)
+        references[domain.name] = {
+            "atoms": ref_atoms,
+            "resids": ref_resids,
+            "coords": ref_coords,
+            "distances": distances,
+            "contact_map": compute_contact_map(ref_atoms.residues.atoms, contact_cutoff, contact_mode),
+        }
+    return references
+
+# Function to compare one domain of a parsed model with the reference using RMSD and additional metrics
+def compare_domain(u, model_name, domain, reference, contact_cutoff=5.0, contact_mode="ca"):
+    domain_atoms = u.select_atoms(f"segid {domain.segid} and resid {domain.resid_range} and name CA")
+    print(f"Selected {len(domain_atoms)} {domain.name} atoms from segid {domain.segid}, residues {domain.resid_range}")
+    if len(domain_atoms) == 0:
+        print(f"No atoms selected for {domain.name} domain in {model_name}")
+        return None
+
+    # Match the domain's CA atoms to the precomputed reference coordinates on their common residues
+    target_resids, target_coords = ca_coordinates(domain_atoms)
+    common_resids, _, target_common_coords = common_coordinates(reference["resids"], reference["coords"], target_resids, target_coords)
+    if len(common_resids) == 0:
+        print(f"No common residues found between reference and {model_name}")
+        return None
+
+    # RMSDs are computed afterwards for all models at once (see grouped_rmsd), so keep the matched coordinates
+    alignment_record = (model_name, common_resids, target_common_coords)
+
+    # Calculate distance between key residues
+    distances = []
+    for resid1, resid2 in domain.key_residue_pairs:
+        distance = ca_distance(u, domain.segid, resid1, resid2)
+        if distance is not None:
+            distances.append((model_name, resid1, resid2, distance))
+            print(f"Distance between residue {resid1} and {resid2}: {distance:.2f} Å")
+
+    contact_map = compute_contact_map(domain_atoms.residues.atoms, contact_cutoff, contact_mode)
+    return alignment_record, distances, contact_map
+
+def analyze_model(pdb_file, model_name, domains, references, contact_cutoff=5.0, contact_mode="ca"):
+    """Parse one model and compare every domain; returns {domain name: compare_domain result}."""
+    print(f"Processing {pdb_file}")
+    u = mda.Universe(pdb_file)
+    return {domain.name: compare_domain(u, model_name, domain, references[domain.name], contact_cutoff, contact_mode)
+            for domain in domains}
+
+# Function to list the models to analyse, labelled by their job directory
+def find_models(base_dir, model_prefix="ranked_0"):
+    models = []
+    for subdir, _, files in os.walk(base_dir):
+        for file in sorted(files):
+            if file.startswith(model_prefix) and file.endswith(".pdb"):
+                models.append((os.path.join(subdir, file), os.path.join(os.path.relpath(subdir, base_dir), file)))
+    return sorted(models)
+
+# Reference and settings of this process, loaded once by init_worker instead of once per model
+_worker_state = {}
+
+def init_worker(reference_pdb, domains, contact_cutoff=5.0, contact_mode="ca", rmsd_mode="superposed", verbose=False):
+    _worker_state["domains"] = domains
+    _worker_state["references"] = load_reference(reference_pdb, domains, contact_cutoff, contact_mode, verbose)
+    _worker_state["contact_cutoff"] = contact_cutoff
+    _worker_state["contact_mode"] = contact_mode
+    _worker_state["rmsd_mode"] = rmsd_mode
+
+def analyze_model_in_worker(model):
+    """Analyse one (pdb_file, model_name) with the process's reference; returns (pdb_file, results, error)."""
+    pdb_file, model_name = model
+    try:
+        results = analyze_model(pdb_file, model_name, _worker_state["domains"], _worker_state["references"],
+                                _worker_state["contact_cutoff"], _worker_state["contact_mode"])
+        return pdb_file, results, None
+    except Exception as e:
+        return pdb_file, None, str(e)
+
+# Function to analyse all models (or complexes), serially or sharded over a process pool (results keep input order)
+def analyze_models(models, reference_pdb, domains, contact_cutoff=5.0, contact_mode="ca", workers=1, chunksize=None,
+                   rmsd_mode="superposed", analyze=analyze_model_in_worker):
+    initargs = (reference_pdb, domains, contact_cutoff, contact_mode, rmsd_mode)
+    if workers <= 1:
+        init_worker(*initargs)
+        yield from map(analyze, models)
+        return
+
+    if chunksize is None:
+        # Roughly four shards per worker balances scheduling overhead against stragglers
+        chunksize = max(1, len(models) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=initargs) as executor:
+        yield from executor.map(analyze, models, chunksize=chunksize)
+
+# Function to list the complexes with their models: every ranked_*.pdb, or every unrelaxed_*.pdb.
+# ranked_* are the relaxed copies of the unrelaxed_* predictions, so the two sets are never mixed
+def find_complexes(base_dir, model_set="ranked"):
+    if model_set not in MODEL_SETS:
+        raise ValueError(f"Unknown model set {model_set!r}, expected one of {MODEL_SETS}")
+    complexes = []
+    for subdir, _, files in os.walk(base_dir):
+        pdb_files = sorted(os.path.join(subdir, file) for file in files if file.startswith(f"{model_set}_") and file.endswith(".pdb"))
+        if pdb_files:
+            complexes.append((pdb_files, os.path.relpath(subdir, base_dir)))
+    return sorted(complexes, key=lambda item: item[1])
+
+def is_heavy_atom(names):
+    # PDB hydrogen names start with H, or with a digit followed by H (e.g. 1HB)
+    return ~np.char.startswith(np.char.lstrip(names, "0123456789"), "H")
+
+def load_domain_frames(model_atoms, domain, heavy=False):
+    """
+    Slice the domain window of every model of a complex onto one residue axis. model_atoms
+    holds the read_chain_atoms output of each model.
+
+    Returns (resids, ca_frames, heavy_frames): the residues present in every model, their CA
+    coordinates as a (models, residues, 3) array and, if heavy is set, a per-model list of
+    (residue_index, heavy atom coordinates) for heavy-atom contacts.
+    """
+    first_resid, last_resid = (int(resid) for resid in domain.resid_range.split(":"))
+    models = []
+    for chains in model_atoms:
+        resids, names, coords = chains[domain.segid]
+        in_window = (resids >= first_resid) & (resids <= last_resid)
+        models.append((resids[in_window], names[in_window], coords[in_window]))
+    # One CA per residue (the first, as in ca_coordinates) for every model
+    ca_atoms = []
+    for resids, names, coords in models:
+        is_ca = names == "CA"
+        ca_resids, first_index = np.unique(resids[is_ca], return_index=True)
+        ca_atoms.append((ca_resids, coords[is_ca][first_index]))
+    common_resids = ca_atoms[0][0]
+    for ca_resids, _ in ca_atoms[1:]:
+        common_resids = np.intersect1d(common_resids, ca_resids, assume_unique=True)
+    ca_frames = np.stack([coords[np.searchsorted(ca_resids, common_resids)] for ca_resids, coords in ca_atoms])
+
+    heavy_frames = None
+    if heavy:
+        heavy_frames = []
+        for resids, names, coords in models:
+            keep = is_heavy_atom(names) & np.isin(resids, common_resids)
+            heavy_frames.append((np.searchsorted(common_resids, resids[keep]), coords[keep]))
+    return common_resids, ca_frames, heavy_frames
+
+def frame_contact_maps(ca_frames, heavy_frames=None, contact_cutoff=5.0):
+    """Boolean (models, residues, residues) contact maps of every model of a complex."""
+    n_frames, n_residues, _ = ca_frames.shape
+    if heavy_frames is not None:
+        return np.stack([residue_contacts(coords, residue_index, n_residues, contact_cutoff).toarray()
+                         for residue_index, coords in heavy_frames])
+    # Squared CA-CA distances of all frames at once from the Gram matrices
+    frames = ca_frames.astype(np.float64)
+    squared_norms = (frames ** 2).sum(axis=-1)
+    squared_distances = squared_norms[:, :, None] + squared_norms[:, None, :] - 2 * np.einsum('fri,fsi->frs', frames, frames)
+    contacts = squared_distances < contact_cutoff ** 2
+    contacts[:, np.arange(n_residues), np.arange(n_residues)] = False
+    return contacts
+
+def analyze_complex(pdb_files, complex_name, domains, references, contact_cutoff=5.0, contact_mode="ca", rmsd_mode="superposed"):
+    """
+    Compare every model of one complex with the reference for each domain, as array operations
+    over the model axis. Returns {domain name: per-model RMSDs, key distances and contact maps}.
+    """
+    print(f"Processing {len(pdb_files)} models of {complex_name}")
+    # Each model file is read once for the chains of all domains, and every domain window is sliced from it
+    model_atoms = [read_chain_atoms(pdb_file, {domain.segid for domain in domains}) for pdb_file in pdb_files]
+    results = {}
+    for domain in domains:
+        reference = references[domain.name]
+        resids, ca_frames, heavy_frames = load_domain_frames(model_atoms, domain, heavy=contact_mode == "heavy")
+        if len(resids) == 0:
+            print(f"No atoms selected for {domain.name} domain in {complex_name}")
+            results[domain.name] = None
+            continue
+
+        # RMSD of all models at once on the residues shared with the reference
+        _, ref_index, model_index = np.intersect1d(reference["resids"], resids, assume_unique=True, return_indices=True)
+        rmsd = batch_rmsd(ca_frames[:, model_index], reference["coords"][ref_index], superpose=rmsd_mode == "superposed") if len(ref_index) else np.full(len(pdb_files), np.nan)
+
+        # Key residue distances of all models, NaN where a residue is missing
+        distances = np.full((len(pdb_files), len(domain.key_residue_pairs)), np.nan)
+        for p, (resid1, resid2) in enumerate(domain.key_residue_pairs):
+            index1, index2 = np.searchsorted(resids, [resid1, resid2])
+            if index1 < len(resids) and index2 < len(resids) and resids[index1] == resid1 and resids[index2] == resid2:
+                distances[:, p] = np.linalg.norm(ca_frames[:, index1] - ca_frames[:, index2], axis=-1)
+
+        contacts = frame_contact_maps(ca_frames, heavy_frames, contact_cutoff)
+        results[domain.name] = {
+            "models": [os.path.basename(pdb_file) for pdb_file in pdb_files],
+            "rmsd": rmsd,
+            "distances": distances,
+            "contacts": contacts.sum(axis=(1, 2)) // 2,
+            "occupancy": contacts.mean(axis=0),
+        }
+    return results
+
+def analyze_complex_in_worker(complex_models):
+    """Analyse every model of one (pdb_files, complex_name); returns (complex_name, results, error)."""
+    pdb_files, complex_name = complex_models
+    try:
+        results = analyze_complex(pdb_files, complex_name, _worker_state["domains"], _worker_state["references"],
+                                  _worker_state["contact_cutoff"], _worker_state["contact_mode"], _worker_state["rmsd_mode"])
+        return complex_name, results, None
+    except Exception as e:
+        return complex_name, None, str(e)
+
+def run_ensemble_analysis(base_dir, reference_pdb, domains, output_dir=None, contact_cutoff=5.0, contact_mode="ca", workers=1,
+                          chunksize=None, rmsd_mode="superposed", model_set="ranked"):
+    """
+    Compare all ranked_* (or all unrelaxed_*) models of every complex under base_dir with the reference.
+    Writes <domain>_ensemble_results.csv (one row per model) and <domain>_ensemble_spread.csv (the
+    spread of RMSD, key distances and contacts over the models of each complex) to output_dir.
+    """
+    output_dir = output_dir or base_dir
+    os.makedirs(output_dir, exist_ok=True)
+    complexes = find_complexes(base_dir, model_set)
+    print(f"Analysing the models of {len(complexes)} complexes with {workers} worker(s)...")
+
+    model_rows = {domain.name: [] for domain in domains}
+    spread_rows = {domain.name: [] for domain in domains}
+    for complex_name, complex_results, error in analyze_models(complexes, reference_pdb, domains, contact_cutoff, contact_mode,
+                                                                 workers, chunksize, rmsd_mode, analyze=analyze_complex_in_worker):
+        if error is not None:
+            print(f"Failed to process {complex_name}: {error}")
+            continue
+        for domain in domains:
+            result = complex_results[domain.name]
+            if result is None:
+                continue
+            pair_names = [f"Distance {resid1}-{resid2}" for resid1, resid2 in domain.key_residue_pairs]
+            for m, model in enumerate(result["models"]):
+                row = {"Complex": complex_name, "Model": model, "RMSD": result["rmsd"][m], "Contacts": result["contacts"][m]}
+                row.update(zip(pair_names, result["distances"][m]))
+                model_rows[domain.name].append(row)
+
+            occupancy = result["occupancy"]
+            spread = {"Complex": complex_name, "Models": len(result["models"]),
+                      "RMSD Mean": np.mean(result["rmsd"]), "RMSD SD": np.std(result["rmsd"]),
+                      "Contacts Mean": np.mean(result["contacts"]),
+                      # Contacts seen in some but not all models, as a measure of conformational variability
+                      "Variable Contacts": int(((occupancy > 0) & (occupancy < 1)).sum() // 2)}
+            for p, pair_name in enumerate(pair_names):
+                spread[f"{pair_name} Mean"] = np.mean(result["distances"][:, p])
+                spread[f"{pair_name} SD"] = np.std(result["distances"][:, p])
+            spread_rows[domain.name].append(spread)
+
+    results = {}
+    for domain in domains:
+        model_df = pd.DataFrame(model_rows[domain.name])
+        spread_df = pd.DataFrame(spread_rows[domain.name])
+        print(spread_df)
+        model_df.to_csv(os.path.join(output_dir, f"{domain.name}_ensemble_results.csv"), index=False)
+        spread_df.to_csv(os.path.join(output_dir, f"{domain.name}_ensemble_spread.csv"), index=False)
+        results[domain.name] = (model_df, spread_df)
+    return results
+
+def plot_domain_results(domain, rmsd_df, distance_df, reference_distance_df, reference_map, mean_contact_map, output_dir):
+    name = domain.name
+    # Plot RMSD results using swarm plot
+    plt.figure(figsize=(4, 8))
+    sns.swarmplot(y=rmsd_df["RMSD"], color='skyblue')
+    plt.ylabel('RMSD (Å)')
+    plt.title(f'RMSD Distribution of {name} Domain to Reference Structure')
+    plt.tight_layout()
+    plt.savefig(os.path.join(output_dir, f"{name}_rmsd_swarmplot.png"))
+    plt.close()
+
+    # Plot Distance results
+    for (resid1, resid2), group in distance_df.groupby(['Residue 1', 'Residue 2']):
+        plt.figure(figsize=(10, 6))
+        plt.scatter(group.index, group["Distance"], color='skyblue')
+        reference_distance = reference_distance_df[(reference_distance_df['Residue 1'] == resid1) & (reference_distance_df['Residue 2'] == resid2)]["Reference Distance"]
+        if len(reference_distance):
+            plt.axhline(y=reference_distance.values[0], color='r', linestyle='--')
+        plt.xlabel('Model Index')
+        plt.ylabel('Distance (Å)')
+        plt.title(f'Distance between residues {resid1} and {resid2} in {name} Domain')
+        plt.tight_layout()
+        plt.savefig(os.path.join(output_dir, f"{name}_distance_{resid1}_{resid2}_scatter.png"))
+        plt.close()
+
+    # Plot the reference contact map, the fraction of models with each contact and their difference
+    maps = [("reference", reference_map.toarray(), 'Blues', None)]
+    if mean_contact_map is not None:
+        maps.append(("models", mean_contact_map, 'Blues', None))
+        maps.append(("diff", mean_contact_map - reference_map.toarray(), 'coolwarm', 0))
+    for label, contact_map, cmap, center in maps:
+        plt.figure(figsize=(10, 8))
+        sns.heatmap(contact_map, cmap=cmap, center=center)
+        plt.title(f'Contact Map of {name} Domain - {label}')
+        plt.xlabel('Residue Index')
+        plt.ylabel('Residue Index')
+        plt.tight_layout()
+        plt.savefig(os.path.join(output_dir, f"{name}_contact_map_{label}.png"))
+        plt.close()
+
+def run_analysis(base_dir, reference_pdb, domains, output_dir=None, contact_cutoff=5.0, contact_mode="ca", workers=1, chunksize=None,
+                 rmsd_mode="superposed"):
+    """
+    Compare every domain of every ranked_0 model under base_dir with the reference, using
+    `workers` processes that each load the reference once. RMSDs are taken after optimal
+    superposition onto the reference ("superposed") or in the models' own frames ("global").
+    Then write
+    <domain>_rmsd_results.csv, <domain>_distance_results.csv, <domain>_reference_distance_results.csv
+    and the plots to output_dir (default base_dir). Returns {domain name: (rmsd_df, distance_df)}.
+    """
+    output_dir = output_dir or base_dir
+    os.makedirs(output_dir, exist_ok=True)
+    references = load_reference(reference_pdb, domains, contact_cutoff, contact_mode)
+
+    alignment_records = {domain.name: [] for domain in domains}
+    distance_results = {domain.name: [] for domain in domains}
+    # Running sum of the contact maps that match the reference map, for the contact occupancy plot
+    contact_sums = {domain.name: None for domain in domains}
+    contact_counts = {domain.name: 0 for domain in domains}
+
+    models = find_models(base_dir)
+    print(f"Analysing {len(models)} models with {workers} worker(s)...")
+    for pdb_file_path, model_results, error in analyze_models(models, reference_pdb, domains, contact_cutoff, contact_mode, workers, chunksize, rmsd_mode):
+        if error is not None:
+            print(f"Failed to process {pdb_file_path}: {error}")
+            continue
+        for name, result in model_results.items():
+            if result is None:
+                continue
+            alignment_record, distances, contact_map = result
+            alignment_records[name].append(alignment_record)
+            distance_results[name].extend(distances)
+            if contact_map.shape == references[name]["contact_map"].shape:
+                contact_sums[name] = contact_map.astype(np.int32) if contact_sums[name] is None else contact_sums[name] + contact_map.astype(np.int32)
+                contact_counts[name] += 1
+
+    results = {}
+    for domain in domains:
+        name = domain.name
+        # RMSD of every model in batches of models sharing the same common residues
+        records = alignment_records[name]
+        rmsds = grouped_rmsd([record[1:] for record in records], references[name]["resids"], references[name]["coords"],
+                             superpose=rmsd_mode == "superposed")
+
+        # Create DataFrames from the results
+        rmsd_df = pd.DataFrame({"PDB File": [record[0] for record in records], "RMSD": rmsds})
+        distance_df = pd.DataFrame(distance_results[name], columns=["PDB File", "Residue 1", "Residue 2", "Distance"])
+        reference_distance_df = pd.DataFrame(references[name]["distances"], columns=["Residue 1", "Residue 2", "Reference Distance"])
+        print(rmsd_df)
+        print(distance_df)
+        print(reference_distance_df)
+
+        mean_contact_map = contact_sums[name].toarray() / contact_counts[name] if contact_counts[name] else None
+        plot_domain_results(domain, rmsd_df, distance_df, reference_distance_df, references[name]["contact_map"], mean_contact_map, output_dir)
+
+        # Save DataFrames to CSV files
+        rmsd_df.to_csv(os.path.join(output_dir, f"{name}_rmsd_results.csv"), index=False)
+        distance_df.to_csv(os.path.join(output_dir, f"{name}_distance_results.csv"), index=False)
+        reference_distance_df.to_csv(os.path.join(output_dir, f"{name}_reference_distance_results.csv"), index=False)
+        results[name] = (rmsd_df, distance_df)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare p300 domain conformations in AlphaFold2 models with a reference structure")
+    parser.add_argument("--predictions-dir", required=True, help="directory containing one subdirectory per prediction job")
+    parser.add_argument("--reference-pdb", required=True, help="reference structure of p300 (segment A)")
+    parser.add_argument("--output-dir", default=None, help="where the CSV files and plots are written (default: the predictions directory)")
+    parser.add_argument("--domain", action="append", choices=sorted(DOMAINS), help="domain to analyse; repeat for several (default: all)")
+    parser.add_argument("--contact-cutoff", type=float, default=5.0, help="contact distance cutoff in Å")
+    parser.add_argument("--contact-mode", default="ca", choices=CONTACT_MODES, help="contacts between CA atoms or any heavy atoms")
+    parser.add_argument("--rmsd-mode", default="superposed", choices=RMSD_MODES, help="superpose each domain onto the reference before the RMSD, or compare the raw model frames")
+    parser.add_argument("--all-models", action="store_true", help="compare every model of each complex and report their spread")
+    parser.add_argument("--model-set", default="ranked", choices=MODEL_SETS, help="with --all-models, use the ranked_* (relaxed) or the unrelaxed_* models")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes used to analyse models")
+    parser.add_argument("--chunksize", type=int, default=None, help="models handed to a worker at a time (default: automatic)")
+    args = parser.parse_args()
+
+    domains = [DOMAINS[name] for name in (args.domain or DOMAINS)]
+    if args.all_models:
+        run_ensemble_analysis(args.predictions_dir, args.reference_pdb, domains, args.output_dir, args.contact_cutoff, args.contact_mode,
+                              args.workers, args.chunksize, args.rmsd_mode, args.model_set)
+    else:
+        run_analysis(args.predictions_dir, args.reference_pdb, domains, args.output_dir, args.contact_cutoff, args.contact_mode,
+                     args.workers, args.chunksize, args.rmsd_mode)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Helpers shared by the scripts that download per-protein data from web services.
+"""
+
+import time
+import threading
+import requests
+
+class TokenBucket:
+    """
+    Thread-safe token-bucket rate limiter: on average `rate` requests per second,
+    with bursts of up to `burst` requests.
+    """
+    def __init__(self, rate=5.0, burst=5):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# One requests.Session per thread, so connections are reused without sharing a session across threads
+_thread_local = threading.local()
+
+def get_session():
+    if not hasattr(_thread_local, "session"):
+        _thread_local.session = requests.Session()
+    return _thread_local.session
+
+def get_with_retries(url, rate_limiter=None, retries=3, backoff=1.0, timeout=10, headers=None, **kwargs):
+    """
+    GET a URL through the thread's session, retrying connection errors, 429 and 5xx
+    responses with exponential backoff. Returns the last response, or raises the last
+    requests exception if no response was ever received. headers are sent with this request
+    only, since the thread's session is shared by every caller on that thread.
+    """
+    session = get_session()
+    for attempt in range(retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            response = session.get(url, timeout=timeout, headers=headers, **kwargs)
+        except requests.exceptions.RequestException:
+            if attempt == retries:
+                raise
+        else:
+            if (response.status_code != 429 and response.status_code < 500) or attempt == retries:
+                return response
+        time.sleep(backoff * 2 ** attempt)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Consolidated, memory-mapped store of the PAE matrices of a whole screen.
+
+All matrices live in one flat binary blob (pae.bin) and a JSON index (pae_index.json)
+records the offset and shape of each matrix, keyed by job directory and result model,
+together with the model's ipTM, pTM and mean pLDDT. Reading a matrix returns a view into
+the memory map, so slicing out an interface block only pages in that block instead of
+unpickling the whole result file.
+
+Build or update the store from the Predictions tree with:
+    python pae_store.py --predictions-dir /path/to/Predictions --store-dir /path/to/pae_store
+
+Changed pickles are appended rather than overwritten, so add --compact now and then to
+rewrite the blob with only the matrices the index still points at.
+"""
+
+import os
+import re
+import json
+import argparse
+import numpy as np
+
+from af2_utils import load_result_metrics, DEFAULT_CACHE_DIR
+
+BLOB_NAME = "pae.bin"
+INDEX_NAME = "pae_index.json"
+# Per-model values kept in the index next to each matrix
+STORE_METRIC_KEYS = ('iptm', 'ptm', 'mean_plddt')
+RESULT_PKL_PATTERN = re.compile(r"^(result_model_\d+_multimer_v3_pred_\d+)\.pkl$")
+
+class PAEStore:
+    def __init__(self, store_dir, dtype="float32"):
+        self.store_dir = store_dir
+        self.index_path = os.path.join(store_dir, INDEX_NAME)
+        self._mmap = None
+
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                self.index = json.load(f)
+        else:
+            self.index = {"dtype": np.dtype(dtype).name, "entries": {}}
+        # The dtype of an existing store always wins so offsets stay valid
+        self.dtype = np.dtype(self.index["dtype"])
+        # Compaction writes a new blob, so the index names the one it points into
+        self.blob_path = os.path.join(store_dir, self.index.get("blob", BLOB_NAME))
+
+    def __contains__(self, key):
+        job, model = key
+        return model in self.index["entries"].get(job, {})
+
+    def jobs(self):
+        return list(self.index["entries"])
+
+    def models(self, job):
+        return sorted(self.index["entries"].get(job, {}))
+
+    def _memmap(self):
+        if self._mmap is None:
+            self._mmap = np.memmap(self.blob_path, dtype=self.dtype, mode='r')
+        return self._mmap
+
+    def get(self, job, model):
+        """Return a read-only, zero-copy view of the PAE matrix of one model of a job."""
+        entry = self.index["entries"][job][model]
+        n_values = int(np.prod(entry["shape"]))
+        return self._memmap()[entry["offset"]:entry["offset"] + n_values].reshape(entry["shape"])
+
+    def metrics(self, job, model):
+        """Return the ipTM, pTM and mean pLDDT stored with a model."""
+        entry = self.index["entries"][job][model]
+        return {key: entry[key] for key in STORE_METRIC_KEYS}
+
+    def is_current(self, job, model, pkl_file_path):
+        entry = self.index["entries"].get(job, {}).get(model)
+        # Entries from stores built before the metrics were kept count as stale
+        if entry is None or not all(key in entry for key in STORE_METRIC_KEYS):
+            return False
+        stat = os.stat(pkl_file_path)
+        return entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size
+
+    def add(self, job, model, metrics, pkl_file_path):
+        # Matrices are only ever appended; a re-added model simply points at its new copy
+        pae = np.ascontiguousarray(metrics['predicted_aligned_error'], dtype=self.dtype)
+        os.makedirs(self.store_dir, exist_ok=True)
+        with open(self.blob_path, 'ab') as f:
+            offset = f.tell() // self.dtype.itemsize
+            f.write(pae.tobytes())
+        stat = os.stat(pkl_file_path)
+        self.index["entries"].setdefault(job, {})[model] = {
+            "offset": offset,
+            "shape": list(pae.shape),
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "iptm": float(metrics['iptm']),
+            "ptm": float(metrics['ptm']),
+            "mean_plddt": float(np.mean(metrics['plddt'])),
+        }
+        self._mmap = None
+
+    def live_bytes(self):
+        return sum(int(np.prod(entry["shape"])) for models in self.index["entries"].values()
+                   for entry in models.values()) * self.dtype.itemsize
+
+    def compact(self):
+        """Rewrite the blob with only the matrices the index points at; returns the bytes freed."""
+        if not os.path.exists(self.blob_path):
+            return 0
+        old_blob_path = self.blob_path
+        old_size = os.path.getsize(old_blob_path)
+        generation = self.index.get("generation", 0) + 1
+        blob_name = f"pae.{generation}.bin"
+        new_offset = 0
+        with open(os.path.join(self.store_dir, blob_name), 'wb') as f:
+            for job in sorted(self.index["entries"]):
+                for model, entry in sorted(self.index["entries"][job].items()):
+                    pae = self.get(job, model)
+                    f.write(np.ascontiguousarray(pae).tobytes())
+                    entry["offset"] = new_offset
+                    new_offset += pae.size
+        # Switching the index to the new blob is the atomic step; processes that already mapped
+        # the old blob keep reading it until they reopen the store
+        self.index["blob"] = blob_name
+        self.index["generation"] = generation
+        self.blob_path = os.path.join(self.store_dir, blob_name)
+        self._mmap = None
+        self.save()
+        os.remove(old_blob_path)
+        return old_size - os.path.getsize(self.blob_path)
+
+    def save(self):
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def build(self, predictions_dir, prefix="", cache_dir=None):
+        """
+        Add every new or changed result pickle under predictions_dir; returns the number added.
+        The pickles are read directly unless a metric cache_dir is given, so by default the PAE
+        matrices are not also written to the metric cache.
+        """
+        added = 0
+        for job in sorted(os.listdir(predictions_dir)):
+            job_dir = os.path.join(predictions_dir, job)
+            if not job.startswith(prefix) or not os.path.isdir(job_dir):
+                continue
+            for filename in sorted(os.listdir(job_dir)):
+                match = RESULT_PKL_PATTERN.match(filename)
+                if not match:
+                    continue
+                model = match.group(1)
+                pkl_file_path = os.path.join(job_dir, filename)
+                if self.is_current(job, model, pkl_file_path):
+                    continue
+                try:
+                    metrics = load_result_metrics(pkl_file_path, ('predicted_aligned_error', 'iptm', 'ptm', 'plddt'), cache_dir=cache_dir)
+                except Exception as e:
+                    print(f"Error reading {pkl_file_path}: {e}")
+                    continue
+                self.add(job, model, metrics, pkl_file_path)
+                added += 1
+            # Save after every job so an interrupted build keeps its progress
+            if added:
+                self.save()
+        self.save()
+        return added
+
+# Stores opened by this process, so pool workers map each store only once
+_open_stores = {}
+
+def open_pae_store(store_dir):
+    if store_dir not in _open_stores:
+        _open_stores[store_dir] = PAEStore(store_dir)
+    return _open_stores[store_dir]
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or update the memory-mapped PAE store from a Predictions tree")
+    parser.add_argument("--predictions-dir", required=True, help="directory containing one subdirectory per prediction job")
+    parser.add_argument("--store-dir", required=True, help="directory where pae.bin and pae_index.json are kept")
+    parser.add_argument("--prefix", default="", help="only index job directories starting with this prefix")
+    parser.add_argument("--dtype", default="float32", choices=["float16", "float32"], help="storage dtype for new stores")
+    parser.add_argument("--cache-dir", default=None, help=f"also fill the per-pickle metric cache while building (e.g. {DEFAULT_CACHE_DIR}); off by default")
+    parser.add_argument("--compact", action="store_true", help="rewrite the blob without the matrices of replaced pickles (run while nothing else reads the store)")
+    args = parser.parse_args()
+
+    store = PAEStore(args.store_dir, args.dtype)
+    added = store.build(args.predictions_dir, args.prefix, args.cache_dir)
+    print(f"Added {added} PAE matrices; the store now holds {len(store.jobs())} jobs")
+    if args.compact:
+        print(f"Compaction freed {store.compact() / 1024 ** 2:.1f} MB")
+    elif os.path.exists(store.blob_path):
+        dead_bytes = os.path.getsize(store.blob_path) - store.live_bytes()
+        if dead_bytes:
+            print(f"{dead_bytes / 1024 ** 2:.1f} MB of the blob belong to replaced pickles; rerun with --compact to free them")
+
+if __name__ == "__main__":
+    main()
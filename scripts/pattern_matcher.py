@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Multi-pattern matching for the domain identification scripts.
+
+AhoCorasick builds one automaton over every pattern (e.g. all ungapped DBD sequences of
+the alignment families), so each protein sequence is scanned once for all patterns instead
+of once per pattern with str.find, and every occurrence of every pattern is reported.
+KeywordMatcher does the same for annotation keywords (e.g. UniProt feature descriptions)
+and reports which keyword matched.
+"""
+
+import re
+from collections import deque
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton over a list of patterns. Duplicate patterns are kept once;
+    iter_matches reports the index of the pattern in self.patterns.
+    """
+    def __init__(self, patterns):
+        self.patterns = list(dict.fromkeys(pattern for pattern in patterns if pattern))
+        # Node 0 is the root; goto holds the trie edges, fail the failure links and
+        # outputs the patterns ending at each node (including those reached through failure links)
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [()]
+        for pattern_index, pattern in enumerate(self.patterns):
+            node = 0
+            for char in pattern:
+                child = self.goto[node].get(char)
+                if child is None:
+                    child = len(self.goto)
+                    self.goto[node][char] = child
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append(())
+                node = child
+            self.outputs[node] = self.outputs[node] + (pattern_index,)
+        self._build_failure_links()
+
+    def _build_failure_links(self):
+        # Children of the root fail to the root; deeper nodes are linked breadth-first
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fail = self.fail[node]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(char, 0)
+                if self.outputs[self.fail[child]]:
+                    self.outputs[child] = self.outputs[child] + self.outputs[self.fail[child]]
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def iter_matches(self, text):
+        """Yield (start, end, pattern_index) for every occurrence in text (0-based, end exclusive)."""
+        goto, fail, outputs, patterns = self.goto, self.fail, self.outputs, self.patterns
+        node = 0
+        for position, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for pattern_index in outputs[node]:
+                yield position + 1 - len(patterns[pattern_index]), position + 1, pattern_index
+
+    def find_all(self, text):
+        return list(self.iter_matches(text))
+
+class KeywordMatcher:
+    """
+    Case-insensitive substring matcher for a list of keywords, compiled into one alternation
+    regex. Longer keywords are tried first, so "sequence-specific dna binding" is reported
+    rather than "dna binding" where both match at the same position.
+    """
+    def __init__(self, keywords):
+        self.keywords = list(dict.fromkeys(keyword.lower() for keyword in keywords if keyword))
+        ordered = sorted(self.keywords, key=len, reverse=True)
+        # An empty keyword list must match nothing rather than every string
+        self.pattern = re.compile("|".join(re.escape(keyword) for keyword in ordered) or r"(?!)")
+
+    def search(self, *texts):
+        """Return the first keyword found in any of the texts, or None."""
+        # Join with newlines so a keyword can never match across two texts
+        match = self.pattern.search("\n".join(text.lower() for text in texts if text))
+        return match.group(0) if match else None
+
+    def find_all(self, *texts):
+        """Return the distinct keywords of all non-overlapping matches in the texts, in order of first occurrence."""
+        text = "\n".join(text.lower() for text in texts if text)
+        return list(dict.fromkeys(match.group(0) for match in self.pattern.finditer(text)))
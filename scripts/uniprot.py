@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Concurrent, cached lookup of UniProtKB entries (features, sequence annotations).
+
+Entries are requested in batches from the UniProt multi-accession endpoint through a bounded
+thread pool and the shared token-bucket rate limiter, following the pages of each response, with
+per-accession requests for anything a batch did not return,
+and every entry is kept in an on-disk JSON cache so reruns never hit the network. In offline mode
+the entries are read from a pre-downloaded dump instead: a UniProt JSON file ({"results": [...]}
+or a list of entries), JSON lines, a directory of <accession>.json files, or UniProt XML
+(e.g. uniprot_sprot.xml.gz), any of them optionally gzipped.
+"""
+
+import os
+import gzip
+import json
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from fetch_utils import TokenBucket, get_with_retries
+
+UNIPROT_ENTRY_URL = "https://rest.uniprot.org/uniprotkb/{accession}.json"
+UNIPROT_ACCESSIONS_URL = "https://rest.uniprot.org/uniprotkb/accessions?accessions={accessions}&format=json&size={size}"
+UNIPROT_HEADERS = {"User-Agent": "Mozilla/5.0"}
+DEFAULT_CACHE_DIR = os.environ.get(
+    "UNIPROT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "uniprot")
+)
+
+# Function to get the accession from a FASTA record ID such as "sp|P04637|P53_HUMAN"
+def accession_from_record_id(record_id):
+    parts = record_id.split("|")
+    return parts[1] if len(parts) > 2 else record_id
+
+def entry_accessions(entry):
+    """Primary and secondary accessions of a UniProt JSON entry."""
+    return [entry.get("primaryAccession")] + list(entry.get("secondaryAccessions", []))
+
+def _match_entries(entries, accessions):
+    # Map each requested accession to its entry, also through secondary accessions
+    wanted = set(accessions)
+    matched = {}
+    for entry in entries:
+        for accession in entry_accessions(entry):
+            if accession in wanted and accession not in matched:
+                matched[accession] = entry
+    return matched
+
+def match_features(uniprot_entry, keyword_matcher):
+    """
+    Return (start, end, keyword) for every feature of a UniProt entry whose type, description
+    or note matches a pattern_matcher.KeywordMatcher, with the keyword that matched.
+    """
+    matches = []
+    for feature in (uniprot_entry or {}).get('features', []):
+        keyword = keyword_matcher.search(feature.get('type', ''), feature.get('description', ''), feature.get('note', ''))
+        if keyword is not None:
+            location = feature.get('location', {})
+            matches.append((location.get('start', {}).get('value'), location.get('end', {}).get('value'), keyword))
+    return matches
+
+def open_dump(path, mode='rt'):
+    # Text dumps are read as utf-8-sig so a byte order mark is dropped
+    encoding = None if 'b' in mode else 'utf-8-sig'
+    return gzip.open(path, mode, encoding=encoding) if path.endswith('.gz') else open(path, mode, encoding=encoding)
+
+def _xml_feature(element, ns):
+    # Convert a UniProt XML <feature> to the layout of the REST JSON features
+    location = element.find(f"{ns}location")
+    start = end = None
+    if location is not None:
+        position = location.find(f"{ns}position")
+        begin, finish = location.find(f"{ns}begin"), location.find(f"{ns}end")
+        if position is not None:
+            start = end = position.get("position")
+        else:
+            start = begin.get("position") if begin is not None else None
+            end = finish.get("position") if finish is not None else None
+    return {
+        "type": element.get("type", ""),
+        "description": element.get("description", ""),
+        "location": {"start": {"value": int(start) if start else None}, "end": {"value": int(end) if end else None}},
+    }
+
+def read_xml_dump(path, accessions):
+    """Stream a UniProt XML dump and return {accession: entry} for the requested accessions."""
+    wanted = set(accessions)
+    found = {}
+    with open_dump(path, 'rb') as f:
+        for _, element in ET.iterparse(f, events=("end",)):
+            if not element.tag.endswith("}entry") and element.tag != "entry":
+                continue
+            ns = element.tag[:-len("entry")]
+            entry_ids = [accession.text for accession in element.findall(f"{ns}accession")]
+            if wanted.intersection(entry_ids):
+                entry = {"primaryAccession": entry_ids[0], "secondaryAccessions": entry_ids[1:],
+                         "features": [_xml_feature(feature, ns) for feature in element.findall(f"{ns}feature")]}
+                found.update(_match_entries([entry], wanted))
+            # Entries are independent, so drop each one once it has been read
+            element.clear()
+            if len(found) == len(wanted):
+                break
+    return found
+
+def read_json_dump(path, accessions):
+    """Return {accession: entry} for the requested accessions from a JSON or JSON lines dump."""
+    with open_dump(path) as f:
+        # The format is decided by the first non-blank character, so leading whitespace is allowed
+        first = ""
+        while not first.strip():
+            first = f.read(1)
+            if not first:
+                return {}
+        f.seek(0)
+        if first == "[" or (first == "{" and not path.endswith((".jsonl", ".jsonl.gz"))):
+            data = json.load(f)
+            entries = data.get("results", [data]) if isinstance(data, dict) else data
+        else:
+            entries = (json.loads(line) for line in f if line.strip())
+        return _match_entries(entries, accessions)
+
+def read_dump(path, accessions):
+    """Read the requested entries from an offline UniProt dump (file or directory of <accession>.json)."""
+    if os.path.isdir(path):
+        found = {}
+        for accession in accessions:
+            for filename in (f"{accession}.json", f"{accession}.json.gz"):
+                entry_path = os.path.join(path, filename)
+                if os.path.exists(entry_path):
+                    with open_dump(entry_path) as f:
+                        found[accession] = json.load(f)
+                    break
+        return found
+    if path.endswith((".xml", ".xml.gz")):
+        return read_xml_dump(path, accessions)
+    return read_json_dump(path, accessions)
+
+class UniProtFetcher:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, offline_dump=None, max_workers=4, batch_size=100,
+                 rate=5.0, burst=5, entry_url=UNIPROT_ENTRY_URL, accessions_url=UNIPROT_ACCESSIONS_URL):
+        self.cache_dir = cache_dir
+        self.offline_dump = offline_dump
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.rate_limiter = TokenBucket(rate, burst)
+        self.entry_url = entry_url
+        self.accessions_url = accessions_url
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _cache_path(self, accession):
+        return os.path.join(self.cache_dir, f"{accession}.json")
+
+    def load_cached(self, accession):
+        if not self.cache_dir or not os.path.exists(self._cache_path(accession)):
+            return None
+        with open(self._cache_path(accession), 'r') as f:
+            return json.load(f)
+
+    def save_cached(self, accession, entry):
+        if not self.cache_dir:
+            return
+        tmp_path = f"{self._cache_path(accession)}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self._cache_path(accession))
+
+    def _download_one(self, accession):
+        try:
+            response = get_with_retries(self.entry_url.format(accession=accession), self.rate_limiter, headers=UNIPROT_HEADERS)
+        except requests.exceptions.RequestException as e:
+            print(f"Failed to fetch UniProt entry for {accession}: {e}")
+            return None
+        if response.status_code != 200:
+            print(f"Failed to fetch UniProt entry for {accession}: {response.status_code}")
+            return None
+        return response.json()
+
+    def _download_batch(self, accessions):
+        """
+        Fetch a batch from the multi-accession endpoint, following the Link header to later pages,
+        and fetch every accession the batch did not return (or all of them if it failed) one by one.
+        """
+        # Ask for the whole batch in one page; any further pages are still followed
+        url = self.accessions_url.format(accessions=",".join(accessions), size=len(accessions))
+        results = []
+        try:
+            while url:
+                response = get_with_retries(url, self.rate_limiter, headers=UNIPROT_HEADERS)
+                if response.status_code != 200:
+                    print(f"Batch UniProt request failed ({response.status_code})")
+                    break
+                results.extend(response.json().get("results", []))
+                url = response.links.get("next", {}).get("url")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Batch UniProt request failed ({e})")
+
+        entries = _match_entries(results, accessions)
+        missing = [accession for accession in accessions if accession not in entries]
+        if missing:
+            print(f"Fetching {len(missing)} of {len(accessions)} UniProt entries missing from the batch one by one")
+        for accession in missing:
+            entry = self._download_one(accession)
+            if entry is not None:
+                entries[accession] = entry
+        return entries
+
+    def fetch(self, accession):
+        """Return the UniProt JSON entry of one accession, or None if it is not available."""
+        return self.fetch_many([accession]).get(accession)
+
+    def fetch_many(self, accessions):
+        """Return {accession: entry} for every accession with an entry."""
+        results = {}
+        missing = []
+        for accession in dict.fromkeys(accessions):
+            cached = self.load_cached(accession)
+            if cached is not None:
+                results[accession] = cached
+            else:
+                missing.append(accession)
+        print(f"UniProt entries cached for {len(results)} of {len(results) + len(missing)} accessions")
+        if not missing:
+            return results
+
+        if self.offline_dump:
+            fetched = read_dump(self.offline_dump, missing)
+        else:
+            batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+            fetched = {}
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for entries in executor.map(self._download_batch, batches):
+                    fetched.update(entries)
+
+        for accession, entry in fetched.items():
+            self.save_cached(accession, entry)
+            results[accession] = entry
+        for accession in missing:
+            if accession not in fetched:
+                print(f"No UniProt entry found for {accession}")
+        return results